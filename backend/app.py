@@ -1,6 +1,7 @@
 import os
 import sqlite3
 import json
+import numpy as np
 from flask import Flask, jsonify, Response, request, render_template, send_from_directory
 from flask_cors import CORS, cross_origin
 from werkzeug import utils
@@ -1317,8 +1318,8 @@ def augment_images():
                     except Exception as e:
                         logger.error(f"Error deleting augmented file {filename}: {str(e)}")
         
-        # Process each image
-        successful_augmentations = 0
+        # Collect augmentation work for each image
+        augmentation_items = []
         total_images = len(rows)
         logger.info(f"Processing {total_images} images")
         
@@ -1331,38 +1332,28 @@ def augment_images():
                     logger.info(f"No verified boxes found for {filename}")
                     continue
                     
-                # Prepare bboxes and class labels for augmentation
-                bboxes = []
-                class_labels = []
-                for box in verified_boxes:
-                    x = box.get('x', 0.0)
-                    y = box.get('y', 0.0)
-                    w = box.get('width', 0.0)
-                    h = box.get('height', 0.0)
-                    
-                    # Convert to center coordinates
-                    center_x = x + w/2
-                    center_y = y + h/2
-                    
-                    bboxes.append([center_x, center_y, w, h])
-                    class_labels.append(box.get('label', ''))
+                # Prepare bboxes and class labels for augmentation as an (N, 4) array
+                xywh = np.array([(box.get('x', 0.0), box.get('y', 0.0),
+                                  box.get('width', 0.0), box.get('height', 0.0))
+                                 for box in verified_boxes], dtype=np.float64)
+                
+                # Convert to center coordinates
+                bboxes = np.column_stack([xywh[:, :2] + xywh[:, 2:] / 2, xywh[:, 2:]])
+                class_labels = [box.get('label', '') for box in verified_boxes]
                 
                 # Create augmented versions using the existing pipeline
                 src_path = os.path.join('uploads', filename)
                 base_output_path = os.path.join('datasets/train/images', filename)
                 base_label_path = os.path.join('datasets/train/labels', os.path.splitext(filename)[0] + '.txt')
                 
-                # Create augmented versions
-                if ImageAugmenter.create_augmented_dataset(
+                augmentation_items.append((
                     src_path,
                     bboxes,
                     class_labels,
                     base_output_path,
                     base_label_path,
-                    num_augmentations=num_augmentations
-                ):
-                    successful_augmentations += 1
-                    logger.info(f"Successfully augmented {filename}")
+                    num_augmentations
+                ))
                     
             except Exception as e:
                 logger.error(f"Error augmenting image {filename}: {str(e)}")
@@ -1370,6 +1361,10 @@ def augment_images():
         
         conn.close()
         
+        # Create augmented versions for all images in parallel
+        results = ImageAugmenter.create_dataset_parallel(augmentation_items)
+        successful_augmentations = sum(results)
+        
         logger.info(f"Augmentation complete. Successfully augmented {successful_augmentations} images")
         return jsonify({
             "success": True,
@@ -1597,7 +1592,11 @@ def reset_annotator():
         # Delete few-shot model weights and classes
         for few_shot_file in [
             os.path.join('model', 'few_shot_model.pt'),
-            os.path.join('model', 'few_shot_classes.json')
+            os.path.join('model', 'few_shot_model.safetensors'),
+            os.path.join('model', 'few_shot_model.ts'),
+            os.path.join('model', 'few_shot_cache.bin'),
+            os.path.join('model', 'few_shot_classes.json'),
+            os.path.join('model', 'few_shot_classes_ordered.json')
         ]:
             if os.path.exists(few_shot_file):
                 try:
@@ -2068,4 +2067,9 @@ def clear_results():
         return jsonify({"error": str(e)}), 500
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    debug = True
+    # Warm YOLO in the serving process only, not in the debug reloader's parent;
+    # requests that arrive meanwhile wait on the predictor lock
+    if os.environ.get('YOLO_WARMUP', '1') == '1' and (not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'):
+        Thread(target=YOLOModel.warmup, daemon=True).start()
+    app.run(host="0.0.0.0", port=5000, debug=debug)
\ No newline at end of file
@@ -16,17 +16,31 @@ import glob
 import logging
 import shutil
 import sys
+import yaml
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Persistent connection reused across calls, opened lazily on first use
+_CONN = None
+
+def get_connection():
+    """Return the shared metadata.db connection, opening it in WAL mode if needed."""
+    global _CONN
+    if _CONN is None:
+        _CONN = sqlite3.connect('metadata.db', check_same_thread=False, isolation_level=None)
+        _CONN.execute("PRAGMA journal_mode=WAL")
+        _CONN.execute("PRAGMA synchronous=NORMAL")
+        _CONN.execute("PRAGMA temp_store=MEMORY")
+        _CONN.execute("PRAGMA mmap_size=268435456")
+    return _CONN
+
 def get_all_classes_from_database():
     """Scan all annotations in the database to find all unique classes."""
     all_labels = set()
     try:
-        conn = sqlite3.connect('metadata.db')
-        cursor = conn.cursor()
+        cursor = get_connection().cursor()
         
         # Get all annotations from fully annotated images
         cursor.execute("""
@@ -45,7 +59,7 @@ def get_all_classes_from_database():
                 except Exception as e:
                     logger.error(f"Error parsing annotations: {str(e)}")
         
-        conn.close()
+        cursor.close()
         
         logger.info(f"Found {len(all_labels)} unique classes in database: {sorted(list(all_labels))}")
         return sorted(list(all_labels))
@@ -97,21 +111,24 @@ def create_dataset_yaml(class_map):
     os.makedirs(dataset_dir, exist_ok=True)
     
     # Create class names list in correct order
-    class_names = ["" for _ in range(len(class_map))]
-    for name, idx in class_map.items():
-        class_names[idx] = name
+    items = sorted(class_map.items(), key=lambda kv: kv[1])
+    if [idx for _, idx in items] != list(range(len(items))):
+        logger.warning(f"Class IDs are not contiguous from 0: {class_map}")
+        return False
+    class_names = [name for name, _ in items]
     
     # Create dataset.yaml content
-    content = f"""path: {os.path.abspath(dataset_dir)}
-train: train/images
-val: val/images
-nc: {len(class_map)}
-names: {class_names}
-"""
+    dataset_config = {
+        'path': os.path.abspath(dataset_dir),
+        'train': 'train/images',
+        'val': 'val/images',
+        'nc': len(class_map),
+        'names': class_names
+    }
     
     # Write to file
     with open(os.path.join(dataset_dir, 'dataset.yaml'), 'w') as f:
-        f.write(content)
+        yaml.safe_dump(dataset_config, f, default_flow_style=False, sort_keys=False)
     
     logger.info(f"Created dataset.yaml with {len(class_map)} classes")
     return True
@@ -138,6 +155,20 @@ def update_label_files(class_map):
     all_label_files = train_label_files + val_label_files
     logger.info(f"Found {len(all_label_files)} label files to check")
     
+    # Index the first class ID of every original (non-augmented) label file once,
+    # so augmented files can recover a class ID without reopening the original
+    original_first_cid = {}
+    for label_file in all_label_files:
+        if '_aug' in label_file:
+            continue
+        try:
+            with open(label_file, 'r') as f:
+                first_parts = f.readline().strip().split()
+            if len(first_parts) >= 5:
+                original_first_cid[label_file] = int(first_parts[0])
+        except Exception as e:
+            logger.error(f"Error reading original file {label_file}: {str(e)}")
+    
     files_updated = 0
     
     for label_file in all_label_files:
@@ -165,21 +196,13 @@ def update_label_files(class_map):
                                 base_name = os.path.basename(label_file).split('_aug')[0] + '.txt'
                                 original_file = os.path.join(os.path.dirname(label_file), base_name)
                                 
-                                if os.path.exists(original_file):
-                                    logger.info(f"Checking original file: {original_file}")
-                                    with open(original_file, 'r') as f:
-                                        orig_lines = f.readlines()
-                                    
-                                    # Use the first class from original file if available
-                                    if orig_lines:
-                                        orig_parts = orig_lines[0].strip().split()
-                                        if len(orig_parts) >= 5:
-                                            orig_class_id = int(orig_parts[0])
-                                            if orig_class_id in reverse_map:
-                                                updated_class_id = orig_class_id
-                                                logger.info(f"Using class ID {updated_class_id} from original file")
-                                                updated_lines.append(f"{updated_class_id} {' '.join(parts[1:])}\n")
-                                                continue
+                                # Use the first class from original file if available
+                                orig_class_id = original_first_cid.get(original_file)
+                                if orig_class_id in reverse_map:
+                                    updated_class_id = orig_class_id
+                                    logger.info(f"Using class ID {updated_class_id} from original file {original_file}")
+                                    updated_lines.append(f"{updated_class_id} {' '.join(parts[1:])}\n")
+                                    continue
                             
                             # Default to class ID 0
                             updated_lines.append(f"0 {' '.join(parts[1:])}\n")
@@ -211,31 +234,32 @@ def update_label_files(class_map):
     return files_updated
 
 def main():
-    """Main function."""
+    """Main function. Returns True on success; never exits, since prepare_data imports it."""
     logger.info("Starting class consistency check")
     
     # Get all classes from database
     classes = get_all_classes_from_database()
     if not classes:
         logger.error("No classes found in database. Make sure you have fully annotated images.")
-        sys.exit(1)
+        return False
     
     # Update class mapping
     class_map = update_class_mapping(classes)
     if not class_map:
         logger.error("Failed to update class mapping")
-        sys.exit(1)
+        return False
     
-    # Create or update dataset.yaml
+    # Create or update dataset.yaml. Non-contiguous IDs are normal after a class is
+    # removed; prepare_data writes its own contiguous mapping and dataset.yaml anyway
     if not create_dataset_yaml(class_map):
-        logger.error("Failed to create dataset.yaml")
-        sys.exit(1)
+        logger.warning("Skipped dataset.yaml update, class IDs are not contiguous")
     
     # Update label files
     files_updated = update_label_files(class_map)
     logger.info(f"Updated {files_updated} label files")
     
     logger.info("Class consistency check completed successfully")
+    return True
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    sys.exit(0 if main() else 1)
@@ -3,17 +3,24 @@ import shutil
 import json
 import threading
 import time
+import queue
 import numpy as np
-import random
 from PIL import Image
 import torch
 import torch.nn as nn
 import torch.optim as optim
 from torch.utils.data import Dataset, DataLoader
 import torchvision.transforms as transforms
+import torchvision.transforms.functional as TF
+from torchvision.io import read_file, decode_jpeg, ImageReadMode
 from torchvision.models import resnet50, ResNet50_Weights
 import logging
-import random
+
+try:
+    from safetensors.torch import save_file, safe_open
+    SAFETENSORS_AVAILABLE = True
+except ImportError:
+    SAFETENSORS_AVAILABLE = False
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -21,12 +28,64 @@ logger = logging.getLogger(__name__)
 
 # Global variables to track model status
 MODEL_PATH = 'model/few_shot_model.pt'
+SAFETENSORS_PATH = 'model/few_shot_model.safetensors'
+TORCHSCRIPT_PATH = 'model/few_shot_model.ts'
+CACHE_PATH = 'model/few_shot_cache.bin'
+CLASS_NAMES_PATH = 'model/few_shot_classes_ordered.json'
 TRAINING_IN_PROGRESS = False
 TRAINING_PROGRESS = 0.0
 MODEL_AVAILABLE = os.path.exists(MODEL_PATH)
 MODEL_READY = MODEL_AVAILABLE  # Model is ready if it's available
 LOCK = threading.Lock()
 
+# Micro-batching for single-image predictions: concurrent predict() calls that
+# arrive within PREDICT_BATCH_WINDOW seconds share one predict_batch call
+MAX_PREDICT_BATCH = 16
+PREDICT_BATCH_WINDOW = 0.02
+_PREDICT_QUEUE = queue.Queue()
+_PREDICT_WORKER = None
+
+# Inputs are always 224x224, so let cuDNN benchmark and keep the fastest conv algorithms
+torch.backends.cudnn.benchmark = True
+
+def compile_model(model, mode, device):
+    """Wrap an eval-mode model with torch.compile, falling back to the eager model
+    
+    torch.compile is lazy, so one warm-up forward with the same settings as
+    predict_batch runs inside the guard; Dynamo/Inductor errors surface there
+    instead of on the first request.
+    """
+    if not hasattr(torch, 'compile'):
+        return model
+    compiled = model
+    try:
+        compiled = torch.compile(model, mode=mode, fullgraph=False)
+        example = torch.zeros((1, 3, 224, 224), device=device).to(memory_format=torch.channels_last)
+        with torch.inference_mode(), torch.autocast(device_type=device.type, dtype=torch.float16,
+                                                    enabled=device.type == 'cuda'):
+            compiled(example)
+        return compiled
+    except Exception as e:
+        logger.warning(f"torch.compile unavailable, running eager model: {str(e)}")
+        return getattr(compiled, '_orig_mod', model)
+
+def decode_on_device(img_path, transform, device):
+    """Decode and preprocess an image directly on `device`.
+    
+    JPEGs are decoded with nvJPEG; other formats (or JPEGs nvJPEG rejects) are
+    decoded with PIL and the transformed tensor is moved to the device.
+    """
+    if os.path.splitext(img_path)[1].lower() in ('.jpg', '.jpeg'):
+        try:
+            image = decode_jpeg(read_file(img_path), mode=ImageReadMode.RGB, device=device)
+            image = TF.resize(image, [224, 224], antialias=True)
+            return TF.normalize(image.float().div_(255), mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+        except RuntimeError as e:
+            logger.debug(f"GPU JPEG decode failed for {img_path}, using PIL: {str(e)}")
+    
+    image = Image.open(img_path).convert('RGB')
+    return transform(image).to(device)
+
 class FewShotDataset(Dataset):
     def __init__(self, images_data, transform=None):
         self.images_data = images_data
@@ -46,50 +105,99 @@ class FewShotDataset(Dataset):
         self.class_names = sorted(list(self.classes))
         self.class_map = {name: idx for idx, name in enumerate(self.class_names)}
         
+        # Precompute verified class indices per image so targets are a single index_fill_
+        self.label_indices = [
+            torch.tensor([self.class_map[box.get('label')] for box in img.get('annotations', [])
+                          if box.get('isVerified', False)], dtype=torch.long)
+            for img in images_data
+        ]
+        
+        # Multi-hot targets for every image, stored as one (N, C) matrix
+        self.targets = torch.zeros((len(images_data), len(self.class_names)))
+        for idx, label_idx in enumerate(self.label_indices):
+            self.targets[idx].index_fill_(0, label_idx, 1.0)
+        
+        # Memory-mapped tensor cache, populated by build_cache()
+        self.cache_path = None
+        self.cache_shape = None
+        self._cache = None
+        
         # Save class mapping
         with open('model/few_shot_classes.json', 'w') as f:
             json.dump(self.class_map, f)
     
-    def __len__(self):
-        return len(self.images_data)
-    
-    def __getitem__(self, idx):
-        img_data = self.images_data[idx]
-        filename = img_data.get('filename')
+    def _load_image(self, idx):
+        """Decode and transform a single image from the uploads directory"""
+        filename = self.images_data[idx].get('filename')
         img_path = os.path.join('uploads', filename)
         
         # Load image
         image = Image.open(img_path).convert('RGB')
+        if self.transform:
+            image = self.transform(image)
+        return image
+    
+    def build_cache(self, cache_path=CACHE_PATH):
+        """Decode every image once into a contiguous FP16 memory-mapped array.
         
-        # Get verified boxes
-        verified_boxes = [box for box in img_data.get('annotations', []) 
-                         if box.get('isVerified', False)]
+        The transform is deterministic, so epochs can read the cached tensors instead
+        of re-decoding and resizing each JPEG.
+        """
+        if not self.images_data:
+            return
+        first = self._load_image(0)
+        shape = (len(self.images_data),) + tuple(first.shape)
         
-        # Create target tensor
-        target = torch.zeros(len(self.class_names))
-        for box in verified_boxes:
-            class_idx = self.class_map[box.get('label')]
-            target[class_idx] = 1.0
+        cache = np.memmap(cache_path, dtype=np.float16, mode='w+', shape=shape)
+        cache[0] = first.numpy()
+        for idx in range(1, len(self.images_data)):
+            cache[idx] = self._load_image(idx).numpy()
+        cache.flush()
+        del cache
         
-        if self.transform:
-            image = self.transform(image)
+        # Each DataLoader worker reopens the memmap lazily in __getitem__
+        self.cache_path = cache_path
+        self.cache_shape = shape
+        self._cache = None
+    
+    def __len__(self):
+        return len(self.images_data)
+    
+    def __getitem__(self, idx):
+        if self.cache_shape is not None:
+            if self._cache is None:
+                self._cache = np.memmap(self.cache_path, dtype=np.float16, mode='r', shape=self.cache_shape)
+            image = torch.from_numpy(self._cache[idx].astype(np.float32))
+        else:
+            image = self._load_image(idx)
         
-        return image, target
+        return image, self.targets[idx]
 
 class FewShotModel(nn.Module):
-    def __init__(self, num_classes):
+    def __init__(self, num_classes, pretrained=True):
         super(FewShotModel, self).__init__()
-        # Load pre-trained ResNet50
-        self.backbone = resnet50(weights=ResNet50_Weights.DEFAULT)
+        # Load pre-trained ResNet50 (skipped when a checkpoint will overwrite the weights)
+        self.backbone = resnet50(weights=ResNet50_Weights.DEFAULT if pretrained else None)
+        # Freeze the pretrained feature extractor; only the new head is trained
+        for param in self.backbone.parameters():
+            param.requires_grad = False
         # Replace the final layer
         in_features = self.backbone.fc.in_features
         self.backbone.fc = nn.Sequential(
             nn.Linear(in_features, 512),
             nn.ReLU(),
             nn.Dropout(0.5),
-            nn.Linear(512, num_classes),
-            nn.Sigmoid()
+            nn.Linear(512, num_classes)
         )
+        # NHWC layout lets cuDNN pick tensor-core conv kernels
+        self.backbone = self.backbone.to(memory_format=torch.channels_last)
+    
+    def train(self, mode=True):
+        """Keep the frozen backbone (incl. BatchNorm statistics) in eval mode while training the head"""
+        super(FewShotModel, self).train(False)
+        self.backbone.fc.train(mode)
+        self.training = mode
+        return self
     
     def forward(self, x):
         return self.backbone(x)
@@ -100,18 +208,20 @@ class FewShotModelTrainer:
     _cached_class_names = None
     _cached_transform = None
     _cached_device = None
+    _cached_mtime = None
 
     @staticmethod
     def get_model_status():
         """Return the current model status"""
         global TRAINING_IN_PROGRESS, TRAINING_PROGRESS, MODEL_AVAILABLE, MODEL_READY
-        with LOCK:
-            return {
-                'training_in_progress': TRAINING_IN_PROGRESS,
-                'progress': TRAINING_PROGRESS,
-                'is_available': MODEL_AVAILABLE,
-                'is_ready': MODEL_READY
-            }
+        # Lock-free read: each flag is a single global rebind, which is atomic in CPython;
+        # LOCK only guards the multi-variable transitions on the writer side
+        return {
+            'training_in_progress': TRAINING_IN_PROGRESS,
+            'progress': TRAINING_PROGRESS,
+            'is_available': MODEL_AVAILABLE,
+            'is_ready': MODEL_READY
+        }
     
     @staticmethod
     def prepare_data(images_data):
@@ -122,8 +232,106 @@ class FewShotModelTrainer:
         dataset = FewShotDataset(images_data)
         logger.info(f"Created dataset with {len(dataset)} images and {len(dataset.class_names)} classes")
         
+        # Decode images once up front instead of once per epoch
+        try:
+            dataset.build_cache()
+            logger.info(f"Cached {len(dataset)} preprocessed images in {CACHE_PATH}")
+        except Exception as e:
+            logger.warning(f"Failed to build image cache, decoding images per epoch: {str(e)}")
+        
         return dataset
     
+    @staticmethod
+    def save_checkpoint(model, class_names):
+        """Atomically write the model checkpoint so readers never see a partial file"""
+        # Class names go first, so they are never older than the checkpoint they describe
+        tmp_path = CLASS_NAMES_PATH + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(class_names, f)
+        os.replace(tmp_path, CLASS_NAMES_PATH)
+        
+        state_dict = model.state_dict()
+        tmp_path = MODEL_PATH + '.tmp'
+        torch.save({
+            'model_state_dict': state_dict,
+            'class_names': class_names
+        }, tmp_path, pickle_protocol=5)
+        os.replace(tmp_path, MODEL_PATH)
+        
+        # Also write a safetensors copy, which loads without unpickling
+        saved_safetensors = False
+        if SAFETENSORS_AVAILABLE:
+            try:
+                tmp_path = SAFETENSORS_PATH + '.tmp'
+                save_file({k: v.contiguous() for k, v in state_dict.items()}, tmp_path,
+                          metadata={'class_names': json.dumps(class_names)})
+                os.replace(tmp_path, SAFETENSORS_PATH)
+                saved_safetensors = True
+            except Exception as e:
+                logger.warning(f"Failed to write safetensors checkpoint: {str(e)}")
+        # Never leave an older copy around to shadow the new checkpoint
+        if not saved_safetensors and os.path.exists(SAFETENSORS_PATH):
+            os.remove(SAFETENSORS_PATH)
+    
+    @staticmethod
+    def export_torchscript(model, class_names):
+        """Save a frozen, inference-optimized TorchScript copy of the model"""
+        try:
+            model.eval()
+            frozen = torch.jit.optimize_for_inference(torch.jit.freeze(torch.jit.script(model)))
+            tmp_path = TORCHSCRIPT_PATH + '.tmp'
+            torch.jit.save(frozen, tmp_path, _extra_files={'class_names.json': json.dumps(class_names)})
+            os.replace(tmp_path, TORCHSCRIPT_PATH)
+            logger.info(f"Saved frozen TorchScript model to {TORCHSCRIPT_PATH}")
+        except Exception as e:
+            logger.warning(f"Failed to export TorchScript model: {str(e)}")
+            # Never leave an older export around to shadow the new checkpoint
+            if os.path.exists(TORCHSCRIPT_PATH):
+                os.remove(TORCHSCRIPT_PATH)
+    
+    @staticmethod
+    def _load_torchscript(device, model_mtime):
+        """Return (model, class_names) from the TorchScript export, or (None, None) if unusable"""
+        try:
+            if os.path.getmtime(TORCHSCRIPT_PATH) < model_mtime:
+                return None, None
+            extra_files = {'class_names.json': ''}
+            model = torch.jit.load(TORCHSCRIPT_PATH, map_location=device, _extra_files=extra_files)
+            return model, json.loads(extra_files['class_names.json'])
+        except OSError:
+            return None, None
+        except Exception as e:
+            logger.warning(f"Failed to load TorchScript model, falling back to checkpoint: {str(e)}")
+            return None, None
+    
+    @staticmethod
+    def load_class_names():
+        """Return the ordered class names saved alongside the checkpoint, or None if unavailable"""
+        try:
+            with open(CLASS_NAMES_PATH, 'r') as f:
+                return json.load(f)
+        except Exception:
+            return None
+    
+    @staticmethod
+    def _load_checkpoint(device):
+        """Return (state_dict, class_names), preferring the safetensors checkpoint"""
+        # Only trust the safetensors copy if it was written after the .pt checkpoint
+        if (SAFETENSORS_AVAILABLE and os.path.exists(SAFETENSORS_PATH) and
+                (not os.path.exists(MODEL_PATH) or
+                 os.path.getmtime(SAFETENSORS_PATH) >= os.path.getmtime(MODEL_PATH))):
+            try:
+                with safe_open(SAFETENSORS_PATH, framework='pt', device=str(device)) as f:
+                    class_names = json.loads(f.metadata()['class_names'])
+                    state_dict = {key: f.get_tensor(key) for key in f.keys()}
+                return state_dict, class_names
+            except Exception as e:
+                logger.warning(f"Failed to load safetensors checkpoint, falling back to {MODEL_PATH}: {str(e)}")
+        
+        # Memory-map straight onto the target device instead of staging a CPU copy
+        checkpoint = torch.load(MODEL_PATH, map_location=device, mmap=True, weights_only=True)
+        return checkpoint['model_state_dict'], checkpoint['class_names']
+    
     @staticmethod
     def train_model_thread(images_data):
         """Train few-shot model in a separate thread"""
@@ -140,19 +348,34 @@ class FewShotModelTrainer:
             logger.info("Preparing training data")
             dataset = FewShotModelTrainer.prepare_data(images_data)
             
-            # Create data loader
-            train_loader = DataLoader(dataset, batch_size=32, shuffle=True)
+            device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+            
+            # Create data loader. The memmap cache is just a page-cache read, so worker
+            # processes would only add IPC; they are kept for per-epoch decoding
+            num_workers = 0 if dataset.cache_shape is not None else min(8, os.cpu_count() or 1)
+            train_loader = DataLoader(
+                dataset,
+                batch_size=32,
+                shuffle=True,
+                num_workers=num_workers,
+                pin_memory=device.type == 'cuda',
+                persistent_workers=num_workers > 0,
+                prefetch_factor=2 if num_workers > 0 else None
+            )
             
             # Initialize model
-            device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-            model = FewShotModel(len(dataset.class_names)).to(device)
+            # Not compiled: head-only training runs at most 20 epochs, which compile
+            # time would eat up
+            model = FewShotModel(len(dataset.class_names), pretrained=True).to(device)
             
             # Define loss function and optimizer
-            criterion = nn.BCELoss()
-            optimizer = optim.Adam(model.parameters(), lr=0.001)
+            # The model emits logits; BCEWithLogitsLoss fuses sigmoid + BCE stably
+            criterion = nn.BCEWithLogitsLoss()
+            optimizer = optim.Adam([p for p in model.parameters() if p.requires_grad], lr=0.001)
             
             # Early stopping parameters
             best_loss = float('inf')
+            best_state = None
             patience = 5
             patience_counter = 0
             
@@ -163,7 +386,8 @@ class FewShotModelTrainer:
                 total_loss = 0
                 
                 for batch_idx, (data, target) in enumerate(train_loader):
-                    data, target = data.to(device), target.to(device)
+                    data = data.to(device, memory_format=torch.channels_last, non_blocking=True)
+                    target = target.to(device, non_blocking=True)
                     
                     optimizer.zero_grad()
                     output = model(data)
@@ -177,19 +401,16 @@ class FewShotModelTrainer:
                 
                 # Update progress
                 progress = (epoch + 1) / num_epochs
-                with LOCK:
-                    TRAINING_PROGRESS = progress
+                TRAINING_PROGRESS = progress
                 logger.info(f"Epoch {epoch+1}/{num_epochs}, Loss: {avg_loss:.4f}")
                 
                 # Early stopping check
                 if avg_loss < best_loss:
                     best_loss = avg_loss
                     patience_counter = 0
-                    # Save best model
-                    torch.save({
-                        'model_state_dict': model.state_dict(),
-                        'class_names': dataset.class_names
-                    }, MODEL_PATH)
+                    # Keep the best weights in memory and save them
+                    best_state = {k: v.detach().clone() for k, v in model.state_dict().items()}
+                    FewShotModelTrainer.save_checkpoint(model, dataset.class_names)
                     logger.info(f"New best loss: {best_loss:.4f}, model saved")
                 else:
                     patience_counter += 1
@@ -199,18 +420,30 @@ class FewShotModelTrainer:
                         logger.info(f"Early stopping triggered after {epoch+1} epochs")
                         break
             
-            # Ensure model is saved (in case early stopping didn't trigger)
-            if not os.path.exists(MODEL_PATH):
-                torch.save({
-                    'model_state_dict': model.state_dict(),
-                    'class_names': dataset.class_names
-                }, MODEL_PATH)
+            # A NaN loss never beats best_loss=inf, so no epoch may have improved; don't
+            # fall back to whatever checkpoint an earlier run left on disk
+            if best_state is None:
+                raise RuntimeError("Training produced no finite loss, no model was saved")
+            
+            # Restore the best weights and export them as a frozen TorchScript module
+            model.load_state_dict(best_state)
+            del best_state
+            FewShotModelTrainer.export_torchscript(model, dataset.class_names)
+            model.eval()
+            inference_model = compile_model(model, 'reduce-overhead', device)
             
             with LOCK:
                 TRAINING_IN_PROGRESS = False
-                MODEL_AVAILABLE = True
+                MODEL_AVAILABLE = os.path.exists(MODEL_PATH)
                 TRAINING_PROGRESS = 1.0
                 MODEL_READY = True
+                # Hand the resident trained model straight to the prediction cache
+                # instead of freeing it and reloading the checkpoint from disk
+                FewShotModelTrainer._cached_model = inference_model
+                FewShotModelTrainer._cached_class_names = dataset.class_names
+                FewShotModelTrainer._cached_transform = dataset.transform
+                FewShotModelTrainer._cached_device = device
+                FewShotModelTrainer._cached_mtime = os.path.getmtime(MODEL_PATH)
                 logger.info("Model is now ready for predictions")
                 
         except Exception as e:
@@ -245,41 +478,72 @@ class FewShotModelTrainer:
         """Load and cache the model if not already loaded"""
         global MODEL_AVAILABLE, TRAINING_IN_PROGRESS, MODEL_READY
         
-        with LOCK:
-            if TRAINING_IN_PROGRESS or not MODEL_READY or not MODEL_AVAILABLE:
-                return None, None, None, None
+        # Read flags without LOCK to keep it off the prediction hot path
+        if TRAINING_IN_PROGRESS or not MODEL_READY or not MODEL_AVAILABLE:
+            return None, None, None, None
         
-        # Check if model is already cached
+        try:
+            model_mtime = os.path.getmtime(MODEL_PATH)
+        except OSError:
+            return None, None, None, None
+        
+        # Fast path: model already cached and checkpoint unchanged on disk
         if (FewShotModelTrainer._cached_model is not None and 
-            FewShotModelTrainer._cached_class_names is not None):
+            FewShotModelTrainer._cached_mtime == model_mtime):
             return (FewShotModelTrainer._cached_model, 
                    FewShotModelTrainer._cached_class_names,
                    FewShotModelTrainer._cached_transform,
                    FewShotModelTrainer._cached_device)
         
+        with LOCK:
+            # Another request may have loaded the model while we waited for the lock
+            if (FewShotModelTrainer._cached_model is not None and 
+                FewShotModelTrainer._cached_mtime == model_mtime):
+                return (FewShotModelTrainer._cached_model, 
+                       FewShotModelTrainer._cached_class_names,
+                       FewShotModelTrainer._cached_transform,
+                       FewShotModelTrainer._cached_device)
+            return FewShotModelTrainer._load_model(model_mtime)
+    
+    @staticmethod
+    def _load_model(model_mtime):
+        """Load the checkpoint from disk and populate the model cache (caller holds LOCK)"""
         try:
-            # Load model and class mapping
-            checkpoint = torch.load(MODEL_PATH)
-            class_names = checkpoint['class_names']
+            # A model without classes can never produce predictions; skip deserializing it
+            if FewShotModelTrainer.load_class_names() == []:
+                logger.warning("FewShot model has no classes, skipping checkpoint load")
+                return None, None, None, None
             
-            # Initialize model
             device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-            model = FewShotModel(len(class_names)).to(device)
-            model.load_state_dict(checkpoint['model_state_dict'])
-            model.eval()
             
-            # Create transform
-            transform = transforms.Compose([
-                transforms.Resize((224, 224)),
-                transforms.ToTensor(),
-                transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
-            ])
+            # Prefer the frozen TorchScript export (Conv+BN already folded)
+            model, class_names = FewShotModelTrainer._load_torchscript(device, model_mtime)
+            
+            if model is None:
+                # Load model and class mapping
+                state_dict, class_names = FewShotModelTrainer._load_checkpoint(device)
+                
+                # Initialize model
+                model = FewShotModel(len(class_names), pretrained=False).to(device)
+                model.load_state_dict(state_dict)
+                model.eval()
+                model = compile_model(model, 'reduce-overhead', device)
+            
+            # Create transform once; it does not depend on the weights
+            transform = FewShotModelTrainer._cached_transform
+            if transform is None:
+                transform = transforms.Compose([
+                    transforms.Resize((224, 224)),
+                    transforms.ToTensor(),
+                    transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
+                ])
             
             # Cache everything
             FewShotModelTrainer._cached_model = model
             FewShotModelTrainer._cached_class_names = class_names
             FewShotModelTrainer._cached_transform = transform
             FewShotModelTrainer._cached_device = device
+            FewShotModelTrainer._cached_mtime = model_mtime
             
             logger.info(f"Successfully cached FewShot model with {len(class_names)} classes")
             return model, class_names, transform, device
@@ -303,22 +567,29 @@ class FewShotModelTrainer:
             batch_predictions = {}
             
             # Process images in batches for memory efficiency
-            batch_size = 16  # Adjust based on GPU memory
+            batch_size = MAX_PREDICT_BATCH  # Adjust based on GPU memory
+            
+            # Reusable buffer that images are decoded into, so each batch needs no stack
+            # allocation. On GPU images are decoded straight into a device buffer; on CPU
+            # into a host buffer
+            gpu_decode = device.type == 'cuda'
+            input_buffer = torch.empty((batch_size, 3, 224, 224), dtype=torch.float32, device=device)
             
             for i in range(0, len(filenames), batch_size):
                 batch_filenames = filenames[i:i+batch_size]
                 
                 # Prepare batch of images
-                batch_images = []
                 valid_filenames = []
                 
                 for filename in batch_filenames:
                     img_path = os.path.join('uploads', filename)
                     if os.path.exists(img_path):
                         try:
-                            image = Image.open(img_path).convert('RGB')
-                            image_tensor = transform(image)
-                            batch_images.append(image_tensor)
+                            if gpu_decode:
+                                input_buffer[len(valid_filenames)] = decode_on_device(img_path, transform, device)
+                            else:
+                                image = Image.open(img_path).convert('RGB')
+                                input_buffer[len(valid_filenames)] = transform(image)
                             valid_filenames.append(filename)
                         except Exception as e:
                             logger.error(f"Error processing image {filename}: {str(e)}")
@@ -327,35 +598,47 @@ class FewShotModelTrainer:
                         logger.warning(f"Image file not found: {img_path}")
                         batch_predictions[filename] = []
                 
-                if not batch_images:
+                if not valid_filenames:
                     # No valid images in this batch
                     for filename in batch_filenames:
                         if filename not in batch_predictions:
                             batch_predictions[filename] = []
                     continue
                 
-                # Stack images into a batch tensor
-                batch_tensor = torch.stack(batch_images).to(device)
+                # Pad up to a power-of-two bucket so the compiled model (CUDA graphs under
+                # reduce-overhead) sees a handful of static shapes instead of recompiling.
+                # Eager and TorchScript models gain nothing from it, so they run unpadded
+                num_valid = len(valid_filenames)
+                padded_size = num_valid
+                if gpu_decode and hasattr(model, '_orig_mod'):
+                    padded_size = min(batch_size, 1 << (num_valid - 1).bit_length())
+                batch_tensor = input_buffer[:padded_size].to(memory_format=torch.channels_last)
                 
                 # Get batch predictions
-                with torch.no_grad():
+                # FP16 autocast on GPU; outputs are only thresholded, so precision loss is irrelevant
+                with torch.inference_mode(), torch.autocast(device_type=device.type, dtype=torch.float16,
+                                                            enabled=device.type == 'cuda'):
                     batch_outputs = model(batch_tensor)
-                    batch_predictions_np = batch_outputs.cpu().numpy()
+                    batch_logits = batch_outputs[:num_valid].float().cpu().numpy()
+                
+                # sigmoid(x) > 0.5 <=> x > 0, so threshold on the raw logits for the
+                # whole batch and only compute sigmoid for the positive classes
+                positive_mask = batch_logits > 0.0  # Confidence threshold of 0.5
+                debug_enabled = logger.isEnabledFor(logging.DEBUG)
                 
                 # Process results for each image in the batch
                 for j, filename in enumerate(valid_filenames):
-                    predictions = batch_predictions_np[j]
-                    results = []
+                    positive_classes = np.nonzero(positive_mask[j])[0]
+                    confidences = 1.0 / (1.0 + np.exp(-batch_logits[j, positive_classes]))
+                    results = [{
+                        'label': class_names[k],
+                        'confidence': float(confidence),
+                        'source': 'ai',
+                    } for k, confidence in zip(positive_classes, confidences)]
                     
-                    for k, (class_name, confidence) in enumerate(zip(class_names, predictions)):
-                        if confidence > 0.5:  # Confidence threshold
-                            logger.info(f"FewShot prediction for {filename}: class={class_name}, conf={confidence:.2f}")
-                            
-                            results.append({
-                                'label': class_name,
-                                'confidence': float(confidence),
-                                'source': 'ai',
-                            })
+                    if debug_enabled:
+                        for result in results:
+                            logger.debug(f"FewShot prediction for {filename}: class={result['label']}, conf={result['confidence']:.2f}")
                     
                     batch_predictions[filename] = results
                     logger.info(f"Generated {len(results)} FewShot predictions for {filename}")
@@ -372,15 +655,48 @@ class FewShotModelTrainer:
             logger.error(f"Error in FewShot batch prediction: {str(e)}", exc_info=True)
             return {filename: [] for filename in filenames}
 
+    @staticmethod
+    def _predict_worker():
+        """Drain the predict queue, coalescing requests that arrive together into one batch"""
+        while True:
+            pending = [_PREDICT_QUEUE.get()]
+            deadline = time.monotonic() + PREDICT_BATCH_WINDOW
+            while len(pending) < MAX_PREDICT_BATCH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending.append(_PREDICT_QUEUE.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            results = {}
+            try:
+                filenames = list(dict.fromkeys(filename for filename, _ in pending))
+                logger.info(f"Coalesced {len(pending)} FewShot prediction requests into one batch")
+                results = FewShotModelTrainer.predict_batch(filenames)
+            finally:
+                for filename, slot in pending:
+                    # Each waiter gets its own dicts; callers annotate them in place
+                    slot['result'] = [dict(pred) for pred in results.get(filename, [])]
+                    slot['event'].set()
+
     @staticmethod
     def predict(filename):
-        """Make predictions for an image (backwards compatibility)"""
+        """Make predictions for an image, batched with concurrent requests"""
+        global _PREDICT_WORKER
         try:
             logger.info(f"Making single FewShot prediction for {filename}")
             
-            # Use batch prediction with single image
-            batch_results = FewShotModelTrainer.predict_batch([filename])
-            return batch_results.get(filename, [])
+            with LOCK:
+                if _PREDICT_WORKER is None:
+                    _PREDICT_WORKER = threading.Thread(target=FewShotModelTrainer._predict_worker, daemon=True)
+                    _PREDICT_WORKER.start()
+            
+            slot = {'event': threading.Event(), 'result': []}
+            _PREDICT_QUEUE.put((filename, slot))
+            slot['event'].wait()
+            return slot['result']
             
         except Exception as e:
             logger.error(f"Error making FewShot predictions: {str(e)}", exc_info=True)
@@ -397,6 +713,7 @@ class FewShotModelTrainer:
         FewShotModelTrainer._cached_class_names = None
         FewShotModelTrainer._cached_transform = None
         FewShotModelTrainer._cached_device = None
+        FewShotModelTrainer._cached_mtime = None
         logger.info("Reset FewShot model and cleared cache")
 
 # Initialize the model flags at startup
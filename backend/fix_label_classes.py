@@ -9,13 +9,29 @@ and the label files, and fixes any issues found.
 import os
 import json
 import logging
-import glob
+import io
+import numpy as np
+import yaml
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-def check_and_create_class_mapping():
+def _list_label_files():
+    """List train and val label files in one os.scandir pass per directory."""
+    label_files = []
+    for label_dir in ('datasets/train/labels', 'datasets/val/labels'):
+        if os.path.isdir(label_dir):
+            with os.scandir(label_dir) as entries:
+                label_files.extend(entry.path for entry in entries if entry.name.endswith('.txt'))
+    return label_files
+
+def check_and_create_class_mapping(label_files=None):
     """Check the current dataset and create a master class mapping if needed."""
     class_map = {}
     
@@ -31,11 +47,8 @@ def check_and_create_class_mapping():
         # Scan all label files to discover all classes
         all_labels = set()
         
-        # Check train labels
-        train_label_files = glob.glob('datasets/train/labels/*.txt')
-        val_label_files = glob.glob('datasets/val/labels/*.txt')
-        
-        all_label_files = train_label_files + val_label_files
+        # Check train and val labels
+        all_label_files = label_files if label_files is not None else _list_label_files()
         logger.info(f"Scanning {len(all_label_files)} label files for classes")
         
         # Also scan annotations in the database
@@ -43,18 +56,29 @@ def check_and_create_class_mapping():
         try:
             conn = sqlite3.connect('metadata.db')
             cursor = conn.cursor()
-            cursor.execute("SELECT annotations FROM images WHERE annotations IS NOT NULL")
-            rows = cursor.fetchall()
-            
-            for row in rows:
-                if row[0]:
-                    try:
-                        annotations = json.loads(row[0])
-                        for box in annotations:
-                            if box.get('isVerified', False) and 'label' in box:
-                                all_labels.add(box['label'])
-                    except Exception as e:
-                        logger.error(f"Error parsing annotations: {str(e)}")
+            try:
+                # Let SQLite's JSON1 extension extract distinct verified labels set-wise
+                cursor.execute("""
+                    SELECT DISTINCT json_extract(box.value, '$.label')
+                    FROM images, json_each(images.annotations) AS box
+                    WHERE images.annotations IS NOT NULL
+                      AND json_extract(box.value, '$.isVerified')
+                      AND json_type(box.value, '$.label') IS NOT NULL
+                """)
+                all_labels.update(row[0] for row in cursor.fetchall())
+            except sqlite3.OperationalError as e:
+                # JSON1 unavailable or a malformed row; parse the blobs in Python instead
+                logger.warning(f"JSON query failed, parsing annotations in Python: {str(e)}")
+                cursor.execute("SELECT annotations FROM images WHERE annotations IS NOT NULL")
+                for row in cursor.fetchall():
+                    if row[0]:
+                        try:
+                            annotations = json_loads(row[0])
+                            for box in annotations:
+                                if box.get('isVerified', False) and 'label' in box:
+                                    all_labels.add(box['label'])
+                        except Exception as e:
+                            logger.error(f"Error parsing annotations: {str(e)}")
                         
             conn.close()
             logger.info(f"Found {len(all_labels)} unique class labels in database")
@@ -93,7 +117,62 @@ def check_and_create_class_mapping():
         logger.error(f"Error creating class mapping: {str(e)}")
         return {}, {}
 
-def check_label_files(class_map, reverse_map):
+def _reference_class_id(label_file, num_classes):
+    """Return the class ID to use for an out-of-range box in label_file."""
+    # Try to fix by finding the label in the original file
+    if 'aug' in label_file:
+        # This is an augmented file, check the original file
+        original_file = label_file.replace('_aug', '').split('_aug')[0] + '.txt'
+        if os.path.exists(original_file):
+            logger.info(f"Checking original file {original_file} for reference")
+            try:
+                with open(original_file, 'r') as orig_f:
+                    orig_parts = orig_f.readline().strip().split()
+                
+                # We'll use the first class from the original file as a fallback
+                if len(orig_parts) >= 5:
+                    fixed_class_id = int(orig_parts[0])
+                    if fixed_class_id < num_classes:
+                        logger.info(f"Using class ID {fixed_class_id} from original file")
+                        return fixed_class_id
+            except Exception as e:
+                logger.error(f"Error checking original file: {str(e)}")
+    
+    # Default to class 0 if we couldn't find a reference
+    logger.info(f"Defaulting to class ID 0")
+    return 0
+
+def _fix_label_lines(label_file, lines, num_classes, fixed_class_id):
+    """Check label lines one at a time, returning (has_issues, fixed_lines).
+    
+    Out-of-range class IDs are replaced with `fixed_class_id`.
+    """
+    has_issues = False
+    fixed_lines = []
+    
+    for line in lines:
+        parts = line.strip().split()
+        if len(parts) >= 5:
+            try:
+                class_id = int(parts[0])
+                if class_id >= num_classes:
+                    logger.warning(f"Class ID {class_id} exceeds dataset class count {num_classes} in {label_file}")
+                    has_issues = True
+                    fixed_lines.append(f"{fixed_class_id} {parts[1]} {parts[2]} {parts[3]} {parts[4]}\n")
+                else:
+                    # Line is fine, keep it as is
+                    fixed_lines.append(line)
+            except ValueError:
+                logger.warning(f"Invalid class ID in {label_file}: {parts[0]}")
+                has_issues = True
+                fixed_lines.append(f"0 {parts[1]} {parts[2]} {parts[3]} {parts[4]}\n")
+        else:
+            logger.warning(f"Invalid line format in {label_file}: {line.strip()}")
+            has_issues = True
+    
+    return has_issues, fixed_lines
+
+def check_label_files(class_map, reverse_map, label_files=None):
     """Check label files for class mapping issues."""
     if not class_map:
         logger.error("No class mapping available, cannot check label files")
@@ -103,71 +182,40 @@ def check_label_files(class_map, reverse_map):
     num_classes = len(class_map)
     logger.info(f"Number of classes: {num_classes}")
     
-    # Check train labels
-    train_label_files = glob.glob('datasets/train/labels/*.txt')
-    val_label_files = glob.glob('datasets/val/labels/*.txt')
-    
-    all_label_files = train_label_files + val_label_files
+    # Check train and val labels
+    all_label_files = label_files if label_files is not None else _list_label_files()
     logger.info(f"Found {len(all_label_files)} label files to check")
     
     issues_found = 0
     files_fixed = 0
     
     for label_file in all_label_files:
-        logger.info(f"Checking {label_file}")
+        logger.debug(f"Checking {label_file}")
         try:
-            with open(label_file, 'r') as f:
-                lines = f.readlines()
+            # Read the whole file in one call; the file is only reopened if it needs fixing
+            with open(label_file, 'rb') as f:
+                data = f.read()
             
-            has_issues = False
-            fixed_lines = []
+            if not data.strip():
+                continue
             
-            for line in lines:
-                parts = line.strip().split()
-                if len(parts) >= 5:
-                    try:
-                        class_id = int(parts[0])
-                        if class_id >= num_classes:
-                            logger.warning(f"Class ID {class_id} exceeds dataset class count {num_classes} in {label_file}")
-                            has_issues = True
-                            
-                            # Try to fix by finding the label in the original file
-                            if 'aug' in label_file:
-                                # This is an augmented file, check the original file
-                                original_file = label_file.replace('_aug', '').split('_aug')[0] + '.txt'
-                                if os.path.exists(original_file):
-                                    logger.info(f"Checking original file {original_file} for reference")
-                                    try:
-                                        with open(original_file, 'r') as orig_f:
-                                            orig_lines = orig_f.readlines()
-                                        
-                                        # We'll use the first class from the original file as a fallback
-                                        if orig_lines:
-                                            orig_parts = orig_lines[0].strip().split()
-                                            if len(orig_parts) >= 5:
-                                                fixed_class_id = int(orig_parts[0])
-                                                if fixed_class_id < num_classes:
-                                                    logger.info(f"Using class ID {fixed_class_id} from original file")
-                                                    fixed_line = f"{fixed_class_id} {parts[1]} {parts[2]} {parts[3]} {parts[4]}\n"
-                                                    fixed_lines.append(fixed_line)
-                                                    continue
-                                    except Exception as e:
-                                        logger.error(f"Error checking original file: {str(e)}")
-                            
-                            # Default to class 0 if we couldn't find a reference
-                            logger.info(f"Defaulting to class ID 0")
-                            fixed_line = f"0 {parts[1]} {parts[2]} {parts[3]} {parts[4]}\n"
-                            fixed_lines.append(fixed_line)
-                        else:
-                            # Line is fine, keep it as is
-                            fixed_lines.append(line)
-                    except ValueError:
-                        logger.warning(f"Invalid class ID in {label_file}: {parts[0]}")
-                        has_issues = True
-                        fixed_lines.append(f"0 {parts[1]} {parts[2]} {parts[3]} {parts[4]}\n")
-                else:
-                    logger.warning(f"Invalid line format in {label_file}: {line.strip()}")
-                    has_issues = True
+            # Check all boxes at once; clean files (the common case) stop here. Files
+            # that need fixing, or don't parse, go through the line-by-line path, which
+            # rewrites only the offending lines and keeps valid ones verbatim
+            try:
+                boxes = np.loadtxt(io.BytesIO(data), ndmin=2)
+            except ValueError:
+                boxes = None
+            
+            if (boxes is not None and boxes.shape[1] == 5 and
+                    np.all(boxes[:, 0] == np.floor(boxes[:, 0])) and not (boxes[:, 0] >= num_classes).any()):
+                continue
+            
+            # Out-of-range IDs fall back to the original file's class, or class 0;
+            # look it up once per file rather than once per bad line
+            fixed_class_id = _reference_class_id(label_file, num_classes)
+            has_issues, fixed_lines = _fix_label_lines(label_file, data.decode().splitlines(keepends=True),
+                                                       num_classes, fixed_class_id)
             
             if has_issues:
                 issues_found += 1
@@ -189,9 +237,9 @@ def check_label_files(class_map, reverse_map):
     
     return issues_found, files_fixed
 
-def update_dataset_yaml():
+def update_dataset_yaml(label_files=None):
     """Update the dataset.yaml file with the correct class names."""
-    class_map, _ = check_and_create_class_mapping()
+    class_map, _ = check_and_create_class_mapping(label_files)
     if not class_map:
         logger.error("No class mapping available, cannot update dataset.yaml")
         return False
@@ -204,28 +252,16 @@ def update_dataset_yaml():
             return False
         
         with open(dataset_yaml_path, 'r') as f:
-            lines = f.readlines()
-        
-        # Find the 'names:' line and replace it
-        new_lines = []
-        names_found = False
+            dataset_config = yaml.safe_load(f) or {}
         
-        for line in lines:
-            if line.startswith('names:'):
-                names_found = True
-                sorted_names = [name for name, _ in sorted(class_map.items(), key=lambda x: x[1])]
-                new_lines.append(f"names: {sorted_names}\n")
-            else:
-                new_lines.append(line)
-        
-        if not names_found:
-            # If 'names:' line was not found, add it
-            sorted_names = [name for name, _ in sorted(class_map.items(), key=lambda x: x[1])]
-            new_lines.append(f"names: {sorted_names}\n")
+        # Replace the class names, keeping nc in step with them
+        sorted_names = [name for name, _ in sorted(class_map.items(), key=lambda x: x[1])]
+        dataset_config['nc'] = len(sorted_names)
+        dataset_config['names'] = sorted_names
         
         # Write updated file
         with open(dataset_yaml_path, 'w') as f:
-            f.writelines(new_lines)
+            yaml.safe_dump(dataset_config, f, default_flow_style=False, sort_keys=False)
         
         logger.info(f"Updated dataset config: {dataset_yaml_path}")
         return True
@@ -237,15 +273,18 @@ def update_dataset_yaml():
 if __name__ == "__main__":
     logger.info("Starting label class mapping fix script")
     
+    # List label files once and share the listing between all steps
+    label_files = _list_label_files()
+    
     # Check and create class mapping if needed
-    class_map, reverse_map = check_and_create_class_mapping()
+    class_map, reverse_map = check_and_create_class_mapping(label_files)
     
     # Check label files
-    issues_found, files_fixed = check_label_files(class_map, reverse_map)
+    issues_found, files_fixed = check_label_files(class_map, reverse_map, label_files)
     logger.info(f"Found {issues_found} files with issues, fixed {files_fixed} files")
     
     # Update dataset.yaml
-    if update_dataset_yaml():
+    if update_dataset_yaml(label_files):
         logger.info("Dataset configuration updated successfully")
     else:
         logger.error("Failed to update dataset configuration")
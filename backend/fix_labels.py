@@ -7,8 +7,7 @@ This script is a wrapper around ensure_class_consistency.py.
 import sys
 import os
 import logging
-import glob
-import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -28,18 +27,24 @@ def delete_all_aug_files():
     for directory in [train_images_dir, train_labels_dir, val_images_dir, val_labels_dir]:
         os.makedirs(directory, exist_ok=True)
     
-    # Count of deleted files
-    deleted_count = 0
-    
-    # Delete augmented files from all directories
+    # Collect augmented files from all directories in a single scandir pass each
+    aug_files = []
     for directory in [train_images_dir, train_labels_dir, val_images_dir, val_labels_dir]:
-        for filename in glob.glob(f"{directory}/*_aug*"):
-            try:
-                os.remove(filename)
-                logger.info(f"Deleted {filename}")
-                deleted_count += 1
-            except Exception as e:
-                logger.error(f"Error deleting {filename}: {str(e)}")
+        with os.scandir(directory) as entries:
+            aug_files.extend(entry.path for entry in entries if '_aug' in entry.name)
+    
+    def remove_file(filename):
+        try:
+            os.remove(filename)
+            logger.debug(f"Deleted {filename}")
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting {filename}: {str(e)}")
+            return False
+    
+    # os.remove releases the GIL, so unlinks overlap across threads
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        deleted_count = sum(executor.map(remove_file, aug_files))
     
     logger.info(f"Deleted {deleted_count} augmented files")
     return deleted_count
@@ -1,19 +1,103 @@
 import os
+import shutil
 import numpy as np
+import cv2
 from PIL import Image
 import albumentations as A
-from albumentations.pytorch import ToTensorV2
 import logging
-import gc
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import json
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+CLASSES_PATH = 'model/classes.json'
+
+# YOLO trains at imgsz=640, so augmented copies never need much more resolution
+AUGMENT_TARGET_SIZE = 640
+
+# Parsed classes.json as one (mtime, map) tuple, replaced whole so the augmentation
+# threads that share it never see a map paired with another file's mtime
+_CLASS_MAP_CACHE = (None, None)
+
+# Per-thread Albumentations pipelines; transforms are not guaranteed thread-safe
+_PIPELINES = threading.local()
+
 class ImageAugmenter:
+    @staticmethod
+    def load_class_map():
+        """Return the YOLO class mapping from classes.json, reloading only when the file changes
+        
+        The cache is shared by every augmentation thread; concurrent reloads just
+        parse the same file twice.
+        """
+        global _CLASS_MAP_CACHE
+        mtime = os.path.getmtime(CLASSES_PATH)
+        cached_mtime, class_map = _CLASS_MAP_CACHE
+        if class_map is None or cached_mtime != mtime:
+            with open(CLASSES_PATH, 'r') as f:
+                class_map = json.load(f)
+            _CLASS_MAP_CACHE = (mtime, class_map)
+            logger.info(f"Loaded class mapping from {CLASSES_PATH}: {class_map}")
+        return class_map
+
+    @staticmethod
+    def read_image(image_path, target_size=None):
+        """Decode an image into a 3-channel BGR array with OpenCV
+        
+        With `target_size`, sources much larger than it are decoded at 1/2 or 1/4
+        scale, which libjpeg does in the IDCT instead of decoding full resolution.
+        """
+        flags = cv2.IMREAD_COLOR
+        if target_size:
+            try:
+                # Header-only read; PIL does not decode pixels until asked
+                with Image.open(image_path) as img:
+                    max_side = max(img.size)
+                if max_side > 4 * target_size:
+                    flags = cv2.IMREAD_REDUCED_COLOR_4
+                elif max_side > 2 * target_size:
+                    flags = cv2.IMREAD_REDUCED_COLOR_2
+            except Exception as e:
+                logger.warning(f"Could not read image header for {image_path}: {str(e)}")
+        image = cv2.imread(image_path, flags)
+        if image is None:
+            raise ValueError(f"Could not decode image: {image_path}")
+        return image
+    
+    @staticmethod
+    def clip_boxes(bboxes):
+        """Return bboxes as an (N, 4) float array clipped to the valid [0, 1] range"""
+        boxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+        return np.clip(boxes, 0.0, 1.0)
+    
+    @staticmethod
+    def format_labels(class_ids, bboxes):
+        """Format YOLO label lines for all boxes as a single string (pure ASCII)"""
+        return ''.join(f"{class_id} {x} {y} {w} {h}\n"
+                       for class_id, (x, y, w, h) in zip(class_ids, ImageAugmenter.clip_boxes(bboxes).tolist()))
+    
+    @staticmethod
+    def write_image(output_path, image):
+        """Encode a BGR array to disk with OpenCV, using fast PNG compression"""
+        params = []
+        if os.path.splitext(output_path)[1].lower() == '.png':
+            params = [cv2.IMWRITE_PNG_COMPRESSION, 1]
+        if not cv2.imwrite(output_path, image, params):
+            raise ValueError(f"Could not write image: {output_path}")
+    
     @staticmethod
     def get_augmentation_pipeline():
+        """Return this thread's Albumentations augmentation pipeline, building it on first use"""
+        pipeline = getattr(_PIPELINES, 'pipeline', None)
+        if pipeline is None:
+            pipeline = _PIPELINES.pipeline = ImageAugmenter._build_augmentation_pipeline()
+        return pipeline
+
+    @staticmethod
+    def _build_augmentation_pipeline():
         """Create an augmentation pipeline using Albumentations"""
         logger.info("Creating augmentation pipeline")
         return A.Compose([
@@ -33,28 +117,29 @@ class ImageAugmenter:
         ], bbox_params=A.BboxParams(format='yolo', label_fields=['class_labels'], min_visibility=0.1))
 
     @staticmethod
-    def augment_image(image_path, bboxes, class_labels, output_path, label_path, augmentation_pipeline):
-        """Apply augmentation to a single image and its annotations"""
+    def augment_image(image_path, bboxes, class_labels, output_path, label_path, augmentation_pipeline, image=None):
+        """Apply augmentation to a single image and its annotations
+        
+        If `image` is given it is used as the already-decoded source instead of
+        reading `image_path` again.
+        """
         try:
             logger.info(f"Starting augmentation for image: {image_path}")
             
-            # Read image with PIL and convert to numpy array efficiently
-            with Image.open(image_path) as img:
-                image = np.array(img)
+            # Nothing to learn from: skip the pipeline's blur/noise/colour work entirely
+            if not len(bboxes):
+                logger.info(f"No bounding boxes for {image_path}, skipping augmentation")
+                return False
+            
+            # Read image with OpenCV; the pipeline works on the BGR array as-is
+            if image is None:
+                image = ImageAugmenter.read_image(image_path, target_size=AUGMENT_TARGET_SIZE)
             
             logger.info(f"Image shape: {image.shape}")
             
             # Convert bboxes to list of [x_center, y_center, width, height]
             logger.info("Processing bounding boxes")
-            bboxes_list = []
-            for box in bboxes:
-                x, y, w, h = box
-                # Ensure coordinates are within valid range [0, 1]
-                x = max(0.0, min(1.0, x))
-                y = max(0.0, min(1.0, y))
-                w = max(0.0, min(1.0, w))
-                h = max(0.0, min(1.0, h))
-                bboxes_list.append([x, y, w, h])
+            bboxes_list = ImageAugmenter.clip_boxes(bboxes).tolist()
             
             logger.info(f"Number of bounding boxes: {len(bboxes_list)}")
             
@@ -71,33 +156,21 @@ class ImageAugmenter:
             
             # Save augmented image efficiently
             logger.info(f"Saving augmented image to: {output_path}")
-            with Image.fromarray(augmented['image']) as aug_img:
-                aug_img.save(output_path)
+            ImageAugmenter.write_image(output_path, augmented['image'])
             
             # Save augmented annotations
             logger.info(f"Saving annotations to: {label_path}")
-            with open(label_path, 'w') as f:
-                for box, class_label in zip(augmented['bboxes'], augmented['class_labels']):
-                    x, y, w, h = box
-                    # Ensure coordinates are within valid range [0, 1]
-                    x = max(0.0, min(1.0, x))
-                    y = max(0.0, min(1.0, y))
-                    w = max(0.0, min(1.0, w))
-                    h = max(0.0, min(1.0, h))
-                    # Use the class ID (numeric) directly
-                    f.write(f"{class_label} {x} {y} {w} {h}\n")
-            
-            # Explicitly clean up to free memory
+            with open(label_path, 'wb') as f:
+                # Use the class ID (numeric) directly
+                f.write(ImageAugmenter.format_labels(augmented['class_labels'], augmented['bboxes']).encode('ascii'))
+            
+            # Drop the augmented arrays; refcounting frees them immediately
             del augmented
-            del image
-            gc.collect()
             
             logger.info("Augmentation completed successfully")
             return True
         except Exception as e:
             logger.error(f"Error augmenting image {image_path}: {str(e)}", exc_info=True)
-            # Clean up in case of error
-            gc.collect()
             return False
 
     @staticmethod
@@ -106,6 +179,11 @@ class ImageAugmenter:
         try:
             logger.info(f"Starting dataset creation for: {image_path}")
             
+            # Skip before any file I/O when there is nothing to train on
+            if not len(bboxes):
+                logger.info(f"No bounding boxes for {image_path}, skipping dataset creation")
+                return False
+            
             # Ensure input image exists
             if not os.path.exists(image_path):
                 raise FileNotFoundError(f"Input image not found: {image_path}")
@@ -116,9 +194,7 @@ class ImageAugmenter:
             
             # Load the same class mapping that YOLO uses
             try:
-                with open('model/classes.json', 'r') as f:
-                    class_map = json.load(f)
-                logger.info(f"Loaded class mapping from model/classes.json: {class_map}")
+                class_map = ImageAugmenter.load_class_map()
             except Exception as e:
                 logger.error(f"Failed to load class mapping, creating a new one: {str(e)}")
                 # Create a temporary class mapping
@@ -137,28 +213,32 @@ class ImageAugmenter:
             
             logger.info(f"Converted string labels to numeric IDs: {list(zip(class_labels, numeric_class_labels))}")
             
-            # Save original image efficiently
+            # Save original image efficiently: copy the encoded bytes rather than decoding
+            # and re-encoding it
             logger.info("Saving original image")
-            with Image.open(image_path) as img:
-                img.save(base_output_path)
+            if os.path.exists(base_output_path) and os.path.samefile(image_path, base_output_path):
+                # prepare_data already hard-linked this upload into the dataset
+                logger.info("Original image already in place")
+            else:
+                if os.path.lexists(base_output_path):
+                    os.remove(base_output_path)
+                shutil.copyfile(image_path, base_output_path)
             
             # Save original annotations
             logger.info("Saving original annotations with numeric class IDs")
-            with open(base_label_path, 'w') as f:
-                for box, class_id in zip(bboxes, numeric_class_labels):
-                    x, y, w, h = box
-                    # Ensure coordinates are within valid range [0, 1]
-                    x = max(0.0, min(1.0, x))
-                    y = max(0.0, min(1.0, y))
-                    w = max(0.0, min(1.0, w))
-                    h = max(0.0, min(1.0, h))
-                    f.write(f"{class_id} {x} {y} {w} {h}\n")
+            with open(base_label_path, 'wb') as f:
+                f.write(ImageAugmenter.format_labels(numeric_class_labels, bboxes).encode('ascii'))
             
             # Create augmented versions (reduced from 3 to 1 by default to save memory)
             logger.info("Creating augmented versions")
             augmentation_pipeline = ImageAugmenter.get_augmentation_pipeline()
             successful_augmentations = 0
             
+            # Decode the source once and reuse it for every augmentation. The batched
+            # `images=` target is not used: it applies one set of sampled parameters to
+            # every image, which would make all augmentations identical
+            image = ImageAugmenter.read_image(image_path, target_size=AUGMENT_TARGET_SIZE)
+            
             for aug_idx in range(num_augmentations):
                 logger.info(f"Creating augmentation {aug_idx + 1}/{num_augmentations}")
                 aug_filename = f"{os.path.splitext(base_output_path)[0]}_aug{aug_idx}{os.path.splitext(base_output_path)[1]}"
@@ -170,21 +250,34 @@ class ImageAugmenter:
                     numeric_class_labels,  # Use numeric class IDs instead of string labels
                     aug_filename,
                     aug_label_path,
-                    augmentation_pipeline
+                    augmentation_pipeline,
+                    image=image
                 ):
                     successful_augmentations += 1
-                
-                # Force garbage collection between augmentations
-                gc.collect()
             
             # Clean up
-            del augmentation_pipeline
-            gc.collect()
+            del image
             
             logger.info(f"Successfully created {successful_augmentations} augmented versions")
             return successful_augmentations > 0
         except Exception as e:
             logger.error(f"Error creating augmented dataset for {image_path}: {str(e)}", exc_info=True)
-            # Clean up in case of error
-            gc.collect()
-            return False 
\ No newline at end of file
+            return False 
+
+    @staticmethod
+    def create_dataset_parallel(items, max_workers=None):
+        """Run create_augmented_dataset for many images across a thread pool
+        
+        Each item is a tuple of create_augmented_dataset arguments:
+        (image_path, bboxes, class_labels, base_output_path, base_label_path, num_augmentations).
+        Returns a list of per-item success flags in the same order.
+        """
+        if not items:
+            return []
+        max_workers = min(max_workers or os.cpu_count() or 1, len(items))
+        logger.info(f"Augmenting {len(items)} images with {max_workers} worker threads")
+        
+        # Threads, not processes: OpenCV decode/encode and the Albumentations kernels
+        # release the GIL, and spawned workers would re-import app.py (torch, YOLO) each
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda item: ImageAugmenter.create_augmented_dataset(*item), items))
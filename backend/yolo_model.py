@@ -2,9 +2,12 @@ import os
 import shutil
 import json
 import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
 import time
 import numpy as np
-from PIL import Image
+import cv2
+import yaml
 import torch
 import torch.optim as optim
 from torch.utils.data import Dataset, DataLoader
@@ -24,6 +27,49 @@ MODEL_AVAILABLE = os.path.exists(MODEL_PATH) or os.path.exists('model/training/w
 MODEL_READY = MODEL_AVAILABLE  # Model is ready if it's available
 LOCK = threading.Lock()
 
+# Prediction always runs at imgsz=640, so let cuDNN pick the fastest conv kernels once
+torch.backends.cudnn.benchmark = True
+
+# The cached Ultralytics predictor is not thread-safe: every forward pass on it,
+# including warmup, runs under this lock
+_PREDICT_LOCK = threading.Lock()
+
+# Shared threads for decoding prediction inputs
+_DECODE_POOL = ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1))
+
+# Opt-in torch.compile of the cached prediction model. Off by default: compilation
+# happens lazily on the first call and again for every new batch size
+YOLO_COMPILE = os.environ.get('YOLO_COMPILE', '0') == '1'
+
+# Training loader settings. Workers share batches through /dev/shm (see shm_size in
+# docker-compose.yml) and cache='ram' keeps decoded images across epochs; Ultralytics
+# skips RAM caching when memory is short. Set YOLO_TRAIN_WORKERS=0 or
+# YOLO_TRAIN_CACHE=0 to opt out
+YOLO_TRAIN_WORKERS = int(os.environ.get('YOLO_TRAIN_WORKERS', min(8, max(1, (os.cpu_count() or 1) // 2))))
+YOLO_TRAIN_CACHE = os.environ.get('YOLO_TRAIN_CACHE', 'ram')
+if YOLO_TRAIN_CACHE in ('', '0', 'false', 'False'):
+    YOLO_TRAIN_CACHE = False
+
+# Micro-batching for single-image predictions: concurrent predict() calls that
+# arrive within PREDICT_BATCH_WINDOW seconds share one model call
+MAX_PREDICT_BATCH = 8
+PREDICT_BATCH_WINDOW = 0.02
+_PREDICT_QUEUE = queue.Queue()
+_PREDICT_WORKER = None
+
+# One YOLO label row: class_id center_x center_y width height
+YOLO_LABEL_LINE = "%d %.6f %.6f %.6f %.6f\n"
+
+# Column layout for detections kept internally before conversion to API dicts
+DET_DTYPE = np.dtype([
+    ('x', 'f4'),
+    ('y', 'f4'),
+    ('width', 'f4'),
+    ('height', 'f4'),
+    ('class_id', 'i4'),
+    ('confidence', 'f4')
+])
+
 # Create directories for storing data
 os.makedirs('model', exist_ok=True)
 os.makedirs('datasets/train/images', exist_ok=True)
@@ -32,36 +78,65 @@ os.makedirs('datasets/val/images', exist_ok=True)
 os.makedirs('datasets/val/labels', exist_ok=True)
 
 # Initialize the model flags at startup
-if os.path.exists(MODEL_PATH) or os.path.exists('model/training/weights/last.pt'):
-    MODEL_AVAILABLE = True
-    MODEL_READY = True
+if MODEL_AVAILABLE:
     logger.info("YOLO model found at startup, setting as ready for predictions")
 
 class YOLOModel:
     # Add class variables for model caching
     _cached_model = None
     _cached_model_path = None
+    _cached_model_mtime = None
     _cached_class_map = None
+    _cached_class_map_mtime = None
+    _cached_use_latest = None
+    # Bumped whenever new weights may be on disk (end of training, reset)
+    _cache_version = 0
+    _loaded_version = -1
     
     @staticmethod
     def get_model_status():
         """Return the current model status"""
         global TRAINING_IN_PROGRESS, TRAINING_PROGRESS, MODEL_AVAILABLE, MODEL_READY
-        with LOCK:
-            # Check both possible model locations
-            model_available = os.path.exists(MODEL_PATH) or os.path.exists('model/training/weights/last.pt')
-            return {
-                'training_in_progress': TRAINING_IN_PROGRESS,
-                'progress': TRAINING_PROGRESS,
-                'is_available': model_available,
-                'is_ready': MODEL_READY
-            }
+        # Each flag read is atomic and a slightly stale poll is harmless, so no LOCK;
+        # the filesystem checks below no longer run while holding it either
+        model_available = os.path.exists(MODEL_PATH) or os.path.exists('model/training/weights/last.pt')
+        return {
+            'training_in_progress': TRAINING_IN_PROGRESS,
+            'progress': TRAINING_PROGRESS,
+            'is_available': model_available,
+            'is_ready': MODEL_READY
+        }
     
+    @staticmethod
+    def format_yolo_labels(class_ids, coords):
+        """Format (class_id, center_x, center_y, w, h) rows as YOLO label text in one %-format call"""
+        if not len(class_ids):
+            return ''
+        rows = np.column_stack([np.asarray(class_ids, dtype=np.float64), coords])
+        return (YOLO_LABEL_LINE * len(rows)) % tuple(rows.ravel().tolist())
+
+    @staticmethod
+    def _link_or_copy(src_path, dest_path):
+        """Hard-link src into the dataset, falling back to a plain byte copy across filesystems
+        
+        The link shares the upload's inode: dataset images must only ever be replaced
+        (unlink + write), never written in place.
+        """
+        if os.path.lexists(dest_path):
+            os.remove(dest_path)
+        try:
+            os.link(src_path, dest_path)
+        except OSError:
+            # copyfile skips copy2's metadata syscalls and uses sendfile on Linux
+            shutil.copyfile(src_path, dest_path)
+
     @staticmethod
     def prepare_data(images_data):
-        """Prepare dataset for YOLO training"""
+        """Prepare dataset for YOLO training
+        
+        `images_data` may be any iterable of image records; it is consumed once.
+        """
         logger.info("Starting data preparation")
-        logger.info(f"Received {len(images_data)} images for preparation")
         
         # First, ensure class consistency across all components
         try:
@@ -76,27 +151,26 @@ class YOLOModel:
             logger.error(f"Error ensuring class consistency: {str(e)}")
             # Continue anyway, as we'll create a new class mapping below
         
-        # Verify that all images are fully annotated
-        for img in images_data:
-            filename = img.get('filename', 'unknown')
-            fully_annotated = img.get('isFullyAnnotated', False)
-            if not fully_annotated:
-                logger.warning(f"Image {filename} is not marked as fully annotated - skipping")
-                continue
-                
-            # Count verified annotations
-            verified_boxes = [box for box in img.get('annotations', []) if box.get('isVerified', False)]
-            logger.info(f"Image {filename} has {len(verified_boxes)} verified annotations")
-        
-        # Filter out images without any verified annotations
+        # Single pass over the input: keep only (filename, verified boxes), so the
+        # full records with their unverified annotations aren't held for the whole run
         valid_images = []
+        classes = set()
+        num_received = 0
         for img in images_data:
+            num_received += 1
+            filename = img.get('filename', 'unknown')
+            if not img.get('isFullyAnnotated', False):
+                logger.warning(f"Image {filename} is not marked as fully annotated")
+            
             verified_boxes = [box for box in img.get('annotations', []) if box.get('isVerified', False)]
             if verified_boxes:
-                valid_images.append(img)
+                logger.info(f"Image {filename} has {len(verified_boxes)} verified annotations")
+                valid_images.append((img.get('filename'), verified_boxes))
+                classes.update(box.get('label', '') for box in verified_boxes)
             else:
-                logger.warning(f"Image {img.get('filename', 'unknown')} has no verified annotations - skipping")
+                logger.warning(f"Image {filename} has no verified annotations - skipping")
         
+        logger.info(f"Received {num_received} images for preparation")
         logger.info(f"After filtering, {len(valid_images)} images have verified annotations")
         
         if not valid_images:
@@ -107,16 +181,17 @@ class YOLOModel:
         logger.info("Clearing previous dataset")
         for dir_path in ['datasets/train/images', 'datasets/train/labels', 'datasets/val/images', 'datasets/val/labels']:
             if os.path.exists(dir_path):
-                for filename in os.listdir(dir_path):
-                    # Skip augmented images
-                    if '_aug' in filename:
-                        continue
-                    file_path = os.path.join(dir_path, filename)
-                    try:
-                        if os.path.isfile(file_path):
-                            os.remove(file_path)
-                    except Exception as e:
-                        logger.error(f"Error removing file {file_path}: {str(e)}")
+                # scandir's DirEntry carries the file type, so no extra stat per entry
+                with os.scandir(dir_path) as entries:
+                    for entry in entries:
+                        # Skip augmented images
+                        if '_aug' in entry.name:
+                            continue
+                        try:
+                            if entry.is_file():
+                                os.remove(entry.path)
+                        except Exception as e:
+                            logger.error(f"Error removing file {entry.path}: {str(e)}")
         
         # Ensure directories exist
         os.makedirs('datasets/train/images', exist_ok=True)
@@ -126,16 +201,7 @@ class YOLOModel:
         
         # Create class mapping for the labels
         logger.info("Creating class mapping")
-        classes = set()
-        for img in valid_images:
-            logger.info(f"Processing image {img.get('filename')} for class mapping")
-            for box in img.get('annotations', []):
-                if box.get('isVerified', False):
-                    label = box.get('label', '')
-                    logger.info(f"Found verified label: {label}")
-                    classes.add(label)
-        
-        class_names = sorted(list(classes))
+        class_names = sorted(classes)
         class_map = {name: idx for idx, name in enumerate(class_names)}
         logger.info(f"Found {len(class_map)} classes: {class_names}")
         logger.info(f"Class mapping: {class_map}")
@@ -151,153 +217,102 @@ class YOLOModel:
         
         # Split data: 80% training, 20% validation
         logger.info("Splitting data into training and validation sets")
-        np.random.seed(42)
-        train_indices = np.random.choice(
-            len(valid_images), 
-            int(0.8 * len(valid_images)), 
-            replace=False
-        )
-        train_set = set(train_indices)
-        logger.info(f"Split: {len(train_set)} training images, {len(valid_images) - len(train_set)} validation images")
+        rng = np.random.default_rng(42)
+        num_train = int(0.8 * len(valid_images))
+        is_train = np.zeros(len(valid_images), dtype=bool)
+        is_train[rng.permutation(len(valid_images))[:num_train]] = True
+        logger.info(f"Split: {num_train} training images, {len(valid_images) - num_train} validation images")
         
         successful_train_images = 0
         successful_val_images = 0
         
-        # Process in batches to be more memory efficient
-        logger.info("Processing images in batches")
-        batch_size = 5
+        def convert_boxes_to_yolo(boxes):
+            """Validate and convert box coordinates to YOLO format.
+            
+            Returns (class_ids, coords) where coords is an (N, 4) array of
+            center_x, center_y, width, height for every box that could be converted.
+            """
+            # Resolve numeric class IDs up front so the loop below only converts numbers
+            resolved = [(class_id, box) for box in boxes
+                        if (class_id := class_map.get(box.get('label', ''))) is not None]
+            if len(resolved) != len(boxes):
+                logger.warning(f"Skipping {len(boxes) - len(resolved)} boxes with unknown class labels")
+            
+            class_ids = []
+            raw_coords = []
+            for class_id, box in resolved:
+                try:
+                    raw_coords.append((float(box.get('x', 0.0)), float(box.get('y', 0.0)),
+                                       float(box.get('width', 0.0)), float(box.get('height', 0.0))))
+                    class_ids.append(class_id)
+                except Exception as e:
+                    logger.error(f"Error validating box coordinates: {str(e)}")
+            
+            # Ensure coordinates are within [0, 1]
+            coords = np.clip(np.asarray(raw_coords, dtype=np.float64).reshape(-1, 4), 0.0, 1.0)
+            x, y, w, h = coords.T
+            
+            # Convert to center coordinates, also within [0, 1]
+            center_x = np.clip(x + w / 2, 0.0, 1.0)
+            center_y = np.clip(y + h / 2, 0.0, 1.0)
+            
+            # Ensure width and height don't exceed image bounds
+            w = np.minimum(w, 1.0 - x)
+            h = np.minimum(h, 1.0 - y)
+            
+            return class_ids, np.stack([center_x, center_y, w, h], axis=1)
+        
+        # One directory scan instead of a stat call per image
+        uploaded = set()
+        if os.path.isdir('uploads'):
+            uploaded = {entry.name for entry in os.scandir('uploads') if entry.is_file()}
         
-        def validate_and_convert_box(box, img_width, img_height):
-            """Validate and convert box coordinates to YOLO format"""
-            try:
-                x = float(box.get('x', 0.0))
-                y = float(box.get('y', 0.0))
-                w = float(box.get('width', 0.0))
-                h = float(box.get('height', 0.0))
-                
-                # Ensure coordinates are within [0, 1]
-                x = max(0.0, min(1.0, x))
-                y = max(0.0, min(1.0, y))
-                w = max(0.0, min(1.0, w))
-                h = max(0.0, min(1.0, h))
+        def process_image(i):
+            """Link one image into its split and write its label file; returns the split or None"""
+            filename, verified_boxes = valid_images[i]
+            if not filename:
+                logger.warning(f"No filename for image {i}, skipping")
+                return None
                 
-                # Convert to center coordinates
-                center_x = x + w/2
-                center_y = y + h/2
+            # Source and destination paths
+            src_path = os.path.join('uploads', filename)
+            
+            if filename not in uploaded:
+                logger.warning(f"Source image not found: {src_path}, skipping")
+                return None
+            
+            # Determine if this is for train or validation
+            split = 'train' if is_train[i] else 'val'
+            logger.info(f"Processing {split} image: {filename}")
+            img_dest = os.path.join(f'datasets/{split}/images', filename)
+            label_dest = os.path.join(f'datasets/{split}/labels', os.path.splitext(filename)[0] + '.txt')
+            
+            try:
+                YOLOModel._link_or_copy(src_path, img_dest)
                 
-                # Ensure center coordinates are within [0, 1]
-                center_x = max(0.0, min(1.0, center_x))
-                center_y = max(0.0, min(1.0, center_y))
+                # Validate and convert box coordinates
+                class_ids, coords = convert_boxes_to_yolo(verified_boxes)
                 
-                # Ensure width and height don't exceed image bounds
-                w = min(w, 1.0 - x)
-                h = min(h, 1.0 - y)
+                # Write YOLO format: class_id center_x center_y width height,
+                # built in memory and written with a single call
+                with open(label_dest, 'wb') as f:
+                    f.write(YOLOModel.format_yolo_labels(class_ids, coords).encode('ascii'))
                 
-                return center_x, center_y, w, h
+                logger.info(f"Successfully processed {split} image: {filename}")
+                return split
             except Exception as e:
-                logger.error(f"Error validating box coordinates: {str(e)}")
+                logger.error(f"Error processing {split} image {filename}: {str(e)}", exc_info=True)
                 return None
         
-        for batch_start in range(0, len(valid_images), batch_size):
-            batch_end = min(batch_start + batch_size, len(valid_images))
-            logger.info(f"Processing batch {batch_start // batch_size + 1}, images {batch_start}-{batch_end-1}")
-            
-            for i in range(batch_start, batch_end):
-                img_data = valid_images[i]
-                
-                # Only process images with verified boxes
-                verified_boxes = [box for box in img_data.get('annotations', []) 
-                                if box.get('isVerified', False)]
-                
-                if not verified_boxes:
-                    logger.warning(f"No verified boxes in image {i}, skipping")
-                    continue
-                    
-                filename = img_data.get('filename')
-                if not filename:
-                    logger.warning(f"No filename for image {i}, skipping")
-                    continue
-                    
-                # Source and destination paths
-                src_path = os.path.join('uploads', filename)
-                
-                if not os.path.exists(src_path):
-                    logger.warning(f"Source image not found: {src_path}, skipping")
-                    continue
-                
-                # Get image dimensions
-                try:
-                    with Image.open(src_path) as img:
-                        img_width, img_height = img.size
-                except Exception as e:
-                    logger.error(f"Error getting image dimensions for {filename}: {str(e)}")
-                    continue
-                    
-                # Determine if this is for train or validation
-                if i in train_set:
-                    logger.info(f"Processing training image: {filename}")
-                    img_dest = os.path.join('datasets/train/images', filename)
-                    label_dest = os.path.join('datasets/train/labels', os.path.splitext(filename)[0] + '.txt')
-                    
-                    try:
-                        shutil.copy2(src_path, img_dest)
-                        
-                        with open(label_dest, 'w') as f:
-                            for box in verified_boxes:
-                                # Get numeric class ID from the mapping
-                                class_id = class_map.get(box.get('label', ''))
-                                if class_id is None:
-                                    logger.warning(f"Unknown class label: {box.get('label')}, skipping")
-                                    continue
-                                
-                                # Validate and convert box coordinates
-                                coords = validate_and_convert_box(box, img_width, img_height)
-                                if coords is None:
-                                    continue
-                                
-                                center_x, center_y, w, h = coords
-                                
-                                # Write YOLO format: class_id center_x center_y width height
-                                f.write(f"{class_id} {center_x} {center_y} {w} {h}\n")
-                        
-                        successful_train_images += 1
-                        logger.info(f"Successfully processed training image: {filename}")
-                    except Exception as e:
-                        logger.error(f"Error processing training image {filename}: {str(e)}", exc_info=True)
-                else:
-                    logger.info(f"Processing validation image: {filename}")
-                    img_dest = os.path.join('datasets/val/images', filename)
-                    label_dest = os.path.join('datasets/val/labels', os.path.splitext(filename)[0] + '.txt')
-                    
-                    try:
-                        shutil.copy2(src_path, img_dest)
-                        
-                        with open(label_dest, 'w') as f:
-                            for box in verified_boxes:
-                                # Get numeric class ID from the mapping
-                                class_id = class_map.get(box.get('label', ''))
-                                if class_id is None:
-                                    logger.warning(f"Unknown class label: {box.get('label')}, skipping")
-                                    continue
-                                
-                                # Validate and convert box coordinates
-                                coords = validate_and_convert_box(box, img_width, img_height)
-                                if coords is None:
-                                    continue
-                                
-                                center_x, center_y, w, h = coords
-                                
-                                # Write YOLO format: class_id center_x center_y width height
-                                f.write(f"{class_id} {center_x} {center_y} {w} {h}\n")
-                        
-                        successful_val_images += 1
-                        logger.info(f"Successfully processed validation image: {filename}")
-                    except Exception as e:
-                        logger.error(f"Error processing validation image {filename}: {str(e)}", exc_info=True)
-            
-            # Force garbage collection after each batch
-            import gc
-            gc.collect()
+        # Per-image work is file I/O that releases the GIL, so threads overlap it;
+        # the executor bounds concurrency, and counts are tallied on this thread
+        logger.info(f"Processing {len(valid_images)} images")
+        with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) + 4)) as executor:
+            for split in executor.map(process_image, range(len(valid_images))):
+                if split == 'train':
+                    successful_train_images += 1
+                elif split == 'val':
+                    successful_val_images += 1
 
         # Create dataset.yaml for YOLO
         logger.info("Creating dataset configuration")
@@ -309,12 +324,9 @@ class YOLOModel:
             'names': class_names
         }
         
+        # safe_dump quotes class names properly, which str(list) does not
         with open('datasets/dataset.yaml', 'w') as f:
-            for key, value in dataset_config.items():
-                if key == 'names':
-                    f.write(f"{key}: {value}\n")
-                else:
-                    f.write(f"{key}: {value}\n")
+            yaml.safe_dump(dataset_config, f, default_flow_style=False, sort_keys=False)
         
         logger.info(f"Data preparation completed. Successfully processed {successful_train_images} training images and {successful_val_images} validation images")
         return successful_train_images > 0 and successful_val_images > 0
@@ -355,26 +367,35 @@ class YOLOModel:
                 total_epochs = trainer.epochs
                 current_epoch = trainer.epoch + 1  # +1 because epochs are 0-indexed
                 progress = current_epoch / total_epochs
-                with LOCK:
-                    TRAINING_PROGRESS = progress
+                # Single float store from the one writer thread; no lock needed
+                TRAINING_PROGRESS = progress
                 logger.info(f"Training progress: {progress:.2f} - Epoch {current_epoch}/{total_epochs}")
             
             # Register the callback with the YOLO model
             model.add_callback("on_train_epoch_end", on_train_epoch_end)
             
-            # Use a memory-efficient approach for training
-            logger.info("Starting model training with memory-efficient settings")
+            # Loader workers overlap decode/augmentation with compute, and Ultralytics
+            # pins host memory when training on a GPU; see YOLO_TRAIN_WORKERS/YOLO_TRAIN_CACHE
+            # On CUDA, batch=-1 lets Ultralytics size the batch to the GPU's memory
+            # and AMP trains in mixed precision; CPU keeps the fixed batch of 8
+            use_cuda = torch.cuda.is_available()
+            logger.info("Starting model training")
             model.train(
                 data='datasets/dataset.yaml',
                 epochs=50,
                 imgsz=640,
-                batch=8,
+                batch=-1 if use_cuda else 8,
+                amp=True,
+                cos_lr=True,
+                close_mosaic=10,
                 patience=20,
                 project='model',
                 name='training',
                 exist_ok=True,
                 verbose=True,
-                workers=0,
+                workers=YOLO_TRAIN_WORKERS,
+                device=0 if use_cuda else 'cpu',
+                cache=YOLO_TRAIN_CACHE,
                 lr0=0.0001,
             )
             
@@ -395,7 +416,15 @@ class YOLOModel:
             # Set model as ready for predictions
             with LOCK:
                 MODEL_READY = True
+                # Force the next prediction to load the new weights and class mapping
+                YOLOModel._cached_model = None
+                YOLOModel._cached_class_map = None
+                YOLOModel._cache_version += 1
                 logger.info("Model is now ready for predictions")
+            
+            # Warm the cache from the trainer thread so the first post-training
+            # request doesn't pay the weight load
+            YOLOModel.warmup()
                 
         except Exception as e:
             logger.error(f"Error training model: {str(e)}", exc_info=True)
@@ -425,13 +454,9 @@ class YOLOModel:
         return True
     
     @staticmethod
-    def _load_model_if_needed(use_latest=True):
-        """Load and cache the model if not already loaded or if path changed"""
-        global TRAINING_IN_PROGRESS, MODEL_READY
-        
-        with LOCK:
-            if TRAINING_IN_PROGRESS or not MODEL_READY:
-                return None, None
+    def _load_weights(use_latest):
+        """Find the weights to serve and (re)load them into the cache; returns success"""
+        cache_version = YOLOModel._cache_version
         
         # Create a list of potential model paths to try
         model_paths = []
@@ -456,127 +481,241 @@ class YOLOModel:
         # Find the first available model path
         current_model_path = None
         for path in model_paths:
-            if os.path.exists(path):
-                file_size = os.path.getsize(path)
-                if file_size >= 10000:  # At least 10KB
-                    current_model_path = path
-                    break
+            # One stat per candidate gives existence, size and mtime together
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if st.st_size >= 10000:  # At least 10KB
+                current_model_path = path
+                current_model_mtime = st.st_mtime
+                break
         
         if current_model_path is None:
             logger.error("No valid model weights found")
-            return None, None
+            return False
         
-        # Check if we need to reload the model
+        # Check if we need to reload the model: a retrain rewrites the same path,
+        # so the weights' mtime is part of the cache key
         if (YOLOModel._cached_model is None or 
-            YOLOModel._cached_model_path != current_model_path):
+            YOLOModel._cached_model_path != current_model_path or
+            YOLOModel._cached_model_mtime != current_model_mtime):
             
             try:
                 logger.info(f"Loading/reloading model from {current_model_path}")
-                YOLOModel._cached_model = YOLO(current_model_path)
+                model = YOLO(current_model_path)
+                # Fold Conv+BN once at load time rather than on the first predict
+                model.fuse()
+                if YOLO_COMPILE and hasattr(torch, 'compile'):
+                    try:
+                        model.model = torch.compile(model.model, mode='reduce-overhead', dynamic=False)
+                    except Exception as e:
+                        logger.warning(f"torch.compile unavailable, running eager YOLO model: {str(e)}")
+                YOLOModel._cached_model = model
                 YOLOModel._cached_model_path = current_model_path
+                YOLOModel._cached_model_mtime = current_model_mtime
                 logger.info(f"Successfully cached model from {current_model_path}")
             except Exception as e:
                 logger.error(f"Failed to load model from {current_model_path}: {str(e)}")
                 YOLOModel._cached_model = None
                 YOLOModel._cached_model_path = None
-                return None, None
+                YOLOModel._cached_model_mtime = None
+                return False
         
-        # Load class mapping if not cached
-        if YOLOModel._cached_class_map is None:
-            try:
+        YOLOModel._loaded_version = cache_version
+        YOLOModel._cached_use_latest = use_latest
+        return True
+
+    @staticmethod
+    def _load_model_if_needed(use_latest=True):
+        """Load and cache the model if not already loaded or if path changed"""
+        # Plain reads of module-level flags are atomic; LOCK is only needed to reload
+        if TRAINING_IN_PROGRESS or not MODEL_READY:
+            return None, None
+        
+        # Fast path: the weights can only have changed if a retrain or reset bumped
+        # the cache version, so skip the path search and stat calls
+        if (YOLOModel._cached_model is None or
+            YOLOModel._loaded_version != YOLOModel._cache_version or
+            YOLOModel._cached_use_latest != use_latest):
+            with LOCK:
+                if TRAINING_IN_PROGRESS or not MODEL_READY:
+                    return None, None
+                # Another request may have reloaded the weights while we waited for the lock
+                if (YOLOModel._cached_model is None or
+                    YOLOModel._loaded_version != YOLOModel._cache_version or
+                    YOLOModel._cached_use_latest != use_latest):
+                    if not YOLOModel._load_weights(use_latest):
+                        return None, None
+        
+        # Load class mapping if not cached or if classes.json changed on disk
+        try:
+            class_map_mtime = os.path.getmtime('model/classes.json')
+            if (YOLOModel._cached_class_map is None or
+                YOLOModel._cached_class_map_mtime != class_map_mtime):
                 with open('model/classes.json', 'r') as f:
                     class_map = json.load(f)
                 YOLOModel._cached_class_map = {idx: name for name, idx in class_map.items()}
+                YOLOModel._cached_class_map_mtime = class_map_mtime
                 logger.info(f"Cached class mapping with {len(YOLOModel._cached_class_map)} classes")
-            except Exception as e:
-                logger.error(f"Error loading class mapping: {str(e)}")
-                return None, None
+        except Exception as e:
+            logger.error(f"Error loading class mapping: {str(e)}")
+            return None, None
         
         return YOLOModel._cached_model, YOLOModel._cached_class_map
 
+    @staticmethod
+    def _detections_from_result(result):
+        """Convert one Ultralytics result into a DET_DTYPE structured array"""
+        boxes = result.boxes
+        if boxes is None or not len(boxes):
+            return np.empty(0, dtype=DET_DTYPE)
+        
+        # One (N, 6) device->host transfer per image: normalized xyxy, class, confidence
+        host = torch.cat([boxes.xyxyn, boxes.cls[:, None], boxes.conf[:, None]], dim=1).cpu().numpy()
+        xyxyn = host[:, :4]
+        dets = np.empty(len(host), dtype=DET_DTYPE)
+        
+        # Ensure coordinates are within [0,1] range
+        dets['x'] = np.clip(xyxyn[:, 0], 0.0, 0.999)
+        dets['y'] = np.clip(xyxyn[:, 1], 0.0, 0.999)
+        dets['width'] = np.maximum(0.001, np.minimum(1.0 - dets['x'], xyxyn[:, 2] - xyxyn[:, 0]))
+        dets['height'] = np.maximum(0.001, np.minimum(1.0 - dets['y'], xyxyn[:, 3] - xyxyn[:, 1]))
+        dets['class_id'] = host[:, 4]
+        dets['confidence'] = host[:, 5]
+        return dets
+    
+    @staticmethod
+    def detections_to_dicts(dets, class_names):
+        """Expand a DET_DTYPE array into the annotation dicts served by the API"""
+        return [
+            {
+                'x': x,
+                'y': y,
+                'width': w,
+                'height': h,
+                'label': class_names.get(c, f"unknown_{c}"),
+                'confidence': conf,
+                'source': 'ai',
+                'isVerified': False
+            }
+            for x, y, w, h, c, conf in zip(
+                dets['x'].tolist(), dets['y'].tolist(),
+                dets['width'].tolist(), dets['height'].tolist(),
+                dets['class_id'].tolist(), dets['confidence'].tolist()
+            )
+        ]
+    
+    @staticmethod
+    def _run_inference(model, sources):
+        """Call the Ultralytics model with the serving settings used for every prediction
+        
+        `sources` must hold at most MAX_PREDICT_BATCH images: Ultralytics runs a list of
+        arrays as a single batch. Results are streamed rather than collected into a list.
+        """
+        # FP16 on CUDA halves memory traffic; CPU stays in FP32
+        use_cuda = torch.cuda.is_available()
+        return model(
+            sources,
+            stream=True,
+            imgsz=640,
+            batch=min(len(sources), MAX_PREDICT_BATCH),
+            half=use_cuda,
+            device=0 if use_cuda else 'cpu',
+            verbose=False
+        )
+    
+    @staticmethod
+    def warmup():
+        """Load the cached model and run one dummy forward pass to pay CUDA/cuDNN setup up front
+        
+        Called by app.py at server startup and by the training thread; set YOLO_WARMUP=0
+        to skip the startup call (e.g. when cold-start RAM matters).
+        """
+        try:
+            model, _ = YOLOModel._load_model_if_needed(use_latest=True)
+            if model is None:
+                return
+            with _PREDICT_LOCK, torch.inference_mode():
+                for _ in YOLOModel._run_inference(model, [np.zeros((640, 640, 3), dtype=np.uint8)]):
+                    pass
+            logger.info("YOLO model warmed up")
+        except Exception as e:
+            logger.error(f"Error warming up YOLO model: {str(e)}")
+    
+    @staticmethod
+    def predict_batch_arrays(filenames, use_latest=True):
+        """Run batch inference and return (class_names, {filename: DET_DTYPE array})"""
+        logger.info(f"Making batch predictions for {len(filenames)} images")
+        
+        # Load model and class mapping
+        model, class_names = YOLOModel._load_model_if_needed(use_latest)
+        if model is None or class_names is None:
+            logger.warning("Model or class mapping not available for batch prediction")
+            return None, {}
+        
+        # Work in chunks of MAX_PREDICT_BATCH: Ultralytics treats a list of arrays as one
+        # batch, so chunking bounds both decoded host memory and the forward pass size
+        chunks = [filenames[i:i + MAX_PREDICT_BATCH] for i in range(0, len(filenames), MAX_PREDICT_BATCH)]
+        
+        def submit_decode(chunk):
+            # cv2 releases the GIL, so the chunk decodes in parallel on the shared pool
+            return [(filename, _DECODE_POOL.submit(cv2.imread, f'uploads/{filename}', cv2.IMREAD_COLOR))
+                    for filename in chunk]
+        
+        logger.info(f"Running batch inference on {len(filenames)} images in {len(chunks)} chunks")
+        batch_detections = {}
+        pending = submit_decode(chunks[0]) if chunks else []
+        # Inference and the tensor post-processing need no autograd tracking
+        with torch.inference_mode():
+            for chunk_idx in range(len(chunks)):
+                current = pending
+                # Decode the next chunk while this one runs through the model
+                pending = submit_decode(chunks[chunk_idx + 1]) if chunk_idx + 1 < len(chunks) else []
+                
+                valid_images = []
+                valid_filenames = []
+                for filename, future in current:
+                    image = future.result()
+                    if image is not None:
+                        valid_images.append(image)
+                        valid_filenames.append(filename)
+                    else:
+                        logger.warning(f"Image file not found or unreadable: uploads/{filename}")
+                
+                if not valid_images:
+                    continue
+                
+                # Process results for each image. The stream is consumed to the end under
+                # the lock (not zipped, which would stop one item short) so Ultralytics
+                # runs its on_predict_end teardown before the next caller gets the model
+                with _PREDICT_LOCK:
+                    results = YOLOModel._run_inference(model, valid_images)
+                    try:
+                        for idx, result in enumerate(results):
+                            filename = valid_filenames[idx]
+                            batch_detections[filename] = YOLOModel._detections_from_result(result)
+                            logger.info(f"Generated {len(batch_detections[filename])} predictions for {filename}")
+                    finally:
+                        results.close()
+        
+        if not batch_detections:
+            logger.warning("No valid images found for batch prediction")
+        
+        return class_names, batch_detections
+
     @staticmethod
     def predict_batch(filenames, use_latest=True):
         """Get predictions for multiple images in batch"""
         try:
-            logger.info(f"Making batch predictions for {len(filenames)} images")
-            
-            # Load model and class mapping
-            model, class_names = YOLOModel._load_model_if_needed(use_latest)
-            if model is None or class_names is None:
-                logger.warning("Model or class mapping not available for batch prediction")
-                return {filename: [] for filename in filenames}
+            class_names, batch_detections = YOLOModel.predict_batch_arrays(filenames, use_latest)
             
-            # Prepare image paths and validate they exist
-            valid_images = []
-            valid_filenames = []
-            
-            for filename in filenames:
-                img_path = f'uploads/{filename}'
-                if os.path.exists(img_path):
-                    valid_images.append(img_path)
-                    valid_filenames.append(filename)
-                else:
-                    logger.warning(f"Image file not found: {img_path}")
-            
-            if not valid_images:
-                logger.warning("No valid images found for batch prediction")
-                return {filename: [] for filename in filenames}
-            
-            # Run batch inference
-            logger.info(f"Running batch inference on {len(valid_images)} images")
-            results = model(valid_images)
-            
-            # Process results for each image
+            # Convert to dicts only here, at the API boundary; files that
+            # weren't processed get empty results
             batch_predictions = {}
-            
-            for i, (filename, result) in enumerate(zip(valid_filenames, results)):
-                predictions = []
-                boxes = result.boxes
-                
-                if boxes is not None:
-                    # Load image for dimensions
-                    img_path = f'uploads/{filename}'
-                    img = Image.open(img_path)
-                    width, height = img.size
-                    
-                    for box in boxes:
-                        x1, y1, x2, y2 = box.xyxy[0].tolist()
-                        conf = float(box.conf[0])
-                        cls = int(box.cls[0])
-                        
-                        # Get class name from mapping
-                        label = class_names.get(cls, f"unknown_{cls}")
-                        
-                        # Convert coordinates to normalized format
-                        x = x1 / width
-                        y = y1 / height
-                        w = (x2 - x1) / width
-                        h = (y2 - y1) / height
-                        
-                        # Ensure coordinates are within [0,1] range
-                        x = max(0.0, min(0.999, x))
-                        y = max(0.0, min(0.999, y))
-                        w = max(0.001, min(1.0 - x, w))
-                        h = max(0.001, min(1.0 - y, h))
-                        
-                        predictions.append({
-                            'x': x,
-                            'y': y,
-                            'width': w,
-                            'height': h,
-                            'label': label,
-                            'confidence': conf,
-                            'source': 'ai',
-                            'isVerified': False
-                        })
-                
-                batch_predictions[filename] = predictions
-                logger.info(f"Generated {len(predictions)} predictions for {filename}")
-            
-            # Add empty results for files that weren't processed
             for filename in filenames:
-                if filename not in batch_predictions:
-                    batch_predictions[filename] = []
+                dets = batch_detections.get(filename)
+                batch_predictions[filename] = [] if dets is None else YOLOModel.detections_to_dicts(dets, class_names)
             
             logger.info(f"Batch prediction completed for {len(filenames)} images")
             return batch_predictions
@@ -585,15 +724,51 @@ class YOLOModel:
             logger.error(f"Error in batch prediction: {str(e)}", exc_info=True)
             return {filename: [] for filename in filenames}
 
+    @staticmethod
+    def _predict_worker():
+        """Drain the predict queue, coalescing requests that arrive together into one batch"""
+        while True:
+            pending = [_PREDICT_QUEUE.get()]
+            deadline = time.monotonic() + PREDICT_BATCH_WINDOW
+            while len(pending) < MAX_PREDICT_BATCH:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    pending.append(_PREDICT_QUEUE.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            # Requests for different weights can't share a model call
+            for use_latest in {use_latest for _, use_latest, _ in pending}:
+                group = [item for item in pending if item[1] == use_latest]
+                results = {}
+                try:
+                    filenames = list(dict.fromkeys(filename for filename, _, _ in group))
+                    logger.info(f"Coalesced {len(group)} prediction requests into one batch")
+                    results = YOLOModel.predict_batch(filenames, use_latest)
+                finally:
+                    for filename, _, slot in group:
+                        # Each waiter gets its own dicts; callers annotate them in place
+                        slot['result'] = [dict(pred) for pred in results.get(filename, [])]
+                        slot['event'].set()
+
     @staticmethod
     def predict(filename, use_latest=True):
-        """Get predictions for a single image (backwards compatibility)"""
+        """Get predictions for a single image, batched with concurrent requests"""
+        global _PREDICT_WORKER
         try:
             logger.info(f"Making single prediction for {filename}")
             
-            # Use batch prediction with single image
-            batch_results = YOLOModel.predict_batch([filename], use_latest)
-            return batch_results.get(filename, [])
+            with LOCK:
+                if _PREDICT_WORKER is None:
+                    _PREDICT_WORKER = threading.Thread(target=YOLOModel._predict_worker, daemon=True)
+                    _PREDICT_WORKER.start()
+            
+            slot = {'event': threading.Event(), 'result': []}
+            _PREDICT_QUEUE.put((filename, use_latest, slot))
+            slot['event'].wait()
+            return slot['result']
             
         except Exception as e:
             logger.error(f"Error getting predictions: {str(e)}", exc_info=True)
@@ -608,5 +783,8 @@ class YOLOModel:
         # Clear cached model
         YOLOModel._cached_model = None
         YOLOModel._cached_model_path = None
+        YOLOModel._cached_model_mtime = None
         YOLOModel._cached_class_map = None
-        logger.info("Reset YOLO model and cleared cache")
\ No newline at end of file
+        YOLOModel._cached_class_map_mtime = None
+        YOLOModel._cache_version += 1
+        logger.info("Reset YOLO model and cleared cache")